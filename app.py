@@ -3,15 +3,20 @@ Main Streamlit application for Intelligent Rubric-based Evaluator System
 """
 import streamlit as st
 import os
-import json
+import time
 from datetime import datetime
 from PIL import Image
 import plotly.express as px
 import pandas as pd
-from database import Database, Submission, Evaluation
-from ocr_processor import OCRProcessor
-from rubric_manager import RubricManager
-from evaluator import IntelligentEvaluator
+import metrics
+from metrics import span
+from resources import get_database, get_evaluator, get_metrics_server, get_ocr_processor, get_queue, get_rubric_manager, get_worker_pool, prepare_rubric
+
+# Seconds between status checks while a submission waits for a worker
+JOB_POLL_SECONDS = 1.5
+
+# Page sizes offered on the View Results page
+RESULTS_PAGE_SIZES = [10, 25, 50, 100]
 
 # Page configuration
 st.set_page_config(
@@ -272,20 +277,17 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'db' not in st.session_state:
-    st.session_state.db = Database()
-if 'ocr' not in st.session_state:
-    st.session_state.ocr = OCRProcessor()
-if 'rubric_manager' not in st.session_state:
-    st.session_state.rubric_manager = RubricManager(st.session_state.db)
-if 'evaluator' not in st.session_state:
-    st.session_state.evaluator = IntelligentEvaluator()
+# The database engine, rubric manager, transformer model and OCR engine are
+# shared process-wide and loaded lazily through the resources registry
 
 # Create uploads directory
 os.makedirs('uploads', exist_ok=True)
 
 def main():
+    # Evaluation workers for this process (EVALUATOR_WORKERS=0 leaves it to jobs.py)
+    get_worker_pool()
+    get_metrics_server()
+    
     # Header with enhanced design
     st.markdown("""
         <div style="text-align: center; padding: 2rem 0;">
@@ -308,20 +310,30 @@ def main():
     
     page = st.sidebar.radio(
         "Choose a page",
-        ["🏠 Submit Assignment", "📈 View Results", "📋 Rubric Management", "📊 Analytics Dashboard"],
+        ["🏠 Submit Assignment", "📈 View Results", "📋 Rubric Management", "📊 Analytics Dashboard", "⚡ Performance"],
         label_visibility="collapsed"
     )
     
     if page == "🏠 Submit Assignment":
-        submit_assignment_page()
+        with span('app.submit_page'):
+            job_pending = submit_assignment_page()
+        if job_pending:
+            # Outside the span: waiting for a worker isn't time spent rendering the page
+            time.sleep(JOB_POLL_SECONDS)
+            st.rerun()
     elif page == "📈 View Results":
-        view_results_page()
+        with span('app.results_page'):
+            view_results_page()
     elif page == "📋 Rubric Management":
         rubric_management_page()
     elif page == "📊 Analytics Dashboard":
-        analytics_dashboard_page()
+        with span('app.analytics_page'):
+            analytics_dashboard_page()
+    elif page == "⚡ Performance":
+        performance_page()
 
 def submit_assignment_page():
+    """Render the submission form; returns True while a submitted job is still being evaluated"""
     st.markdown('<h2 class="sub-header">📝 Submit Your Assignment</h2>', unsafe_allow_html=True)
     
     # Info card
@@ -351,6 +363,19 @@ def submit_assignment_page():
         placeholder="Choose assignment type..."
     )
     
+    # Several rubrics can exist for a type; the oldest one is the default
+    rubric_id = None
+    if assignment_type:
+        rubrics = get_rubric_manager().get_rubrics_for_type(assignment_type)
+        if len(rubrics) > 1:
+            rubric_names = {rubric['id']: rubric['name'] for rubric in rubrics}
+            rubric_id = st.selectbox(
+                "Rubric",
+                list(rubric_names),
+                format_func=rubric_names.get,
+                help="Choose the rubric your assignment is graded against"
+            )
+    
     # Input method
     st.markdown("### 📤 Submission Method")
     input_method = st.radio(
@@ -380,12 +405,10 @@ def submit_assignment_page():
                 with st.spinner("🔄 Processing image with advanced OCR (handling blurry images)..."):
                     try:
                         # Save uploaded file
-                        file_path = f"uploads/{student_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{uploaded_file.name.split('.')[-1]}"
-                        with open(file_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
+                        file_path = save_upload(student_id, uploaded_file)
                         
                         # Extract text with enhanced preprocessing
-                        ocr_result = st.session_state.ocr.extract_with_confidence(file_path)
+                        ocr_result = get_ocr_processor().extract_with_confidence(file_path, search_mode='adaptive')
                         student_text = ocr_result['text']
                         
                         # Display results with method info
@@ -411,7 +434,7 @@ def submit_assignment_page():
                         with st.expander("🔍 View Preprocessed Image (for debugging)"):
                             try:
                                 # Get preprocessed image
-                                preprocessed = st.session_state.ocr.preprocess_image(file_path, method=method_used)
+                                preprocessed = get_ocr_processor().preprocess_image(file_path, method=method_used)
                                 # Display the preprocessed grayscale image
                                 st.image(preprocessed, caption=f"Preprocessed Image (Method: {method_used})", use_container_width=True, clamp=True)
                                 st.caption("This is the enhanced image used for OCR extraction. Blurry images are upscaled and sharpened.")
@@ -455,63 +478,75 @@ def submit_assignment_page():
         submit_button = st.button("🚀 Submit for Evaluation", type="primary", use_container_width=True)
     
     if submit_button:
+        # Images whose text was not reviewed yet are OCR'd by the worker
+        answer_text = st.session_state.get('extracted_text', '').strip()
+        image_path = st.session_state.get('image_path') if uploaded_file is not None else None
         if not student_id or not student_name:
             st.error("❌ Please fill in all required fields (Student ID and Name)")
-        elif not st.session_state.get('extracted_text', '').strip():
+        elif not answer_text and uploaded_file is None:
             st.error("❌ Please provide your answer (either upload image or type text)")
         else:
-            with st.spinner("🔄 Evaluating your submission..."):
-                try:
-                    # Get rubric
-                    rubric = st.session_state.rubric_manager.get_rubric(assignment_type)
-                    if not rubric:
-                        st.error("❌ Rubric not found for this assignment type")
-                        return
-                    
-                    # Evaluate
-                    evaluation_result = st.session_state.evaluator.evaluate(
-                        st.session_state.extracted_text,
-                        rubric
+            try:
+                if not answer_text:
+                    image_path = save_upload(student_id, uploaded_file)
+                with span('app.enqueue'):
+                    st.session_state.pending_job_id = get_queue().enqueue(
+                        student_id,
+                        student_name,
+                        assignment_type,
+                        text=answer_text or None,
+                        image_path=image_path,
+                        rubric_id=rubric_id
                     )
-                    
-                    # Save submission
-                    session = st.session_state.db.get_session()
-                    submission = Submission(
-                        student_id=student_id,
-                        student_name=student_name,
-                        assignment_type=assignment_type,
-                        image_path=st.session_state.get('image_path'),
-                        extracted_text=st.session_state.extracted_text,
-                        original_text=st.session_state.extracted_text
-                    )
-                    session.add(submission)
-                    session.flush()
-                    
-                    # Save evaluation
-                    evaluation = Evaluation(
-                        submission_id=submission.id,
-                        rubric_id=rubric['id'],
-                        overall_score=evaluation_result['overall_score'],
-                        detailed_scores=json.dumps(evaluation_result['detailed_scores']),
-                        feedback=evaluation_result['feedback'],
-                        strengths=json.dumps(evaluation_result['strengths']),
-                        weaknesses=json.dumps(evaluation_result['weaknesses']),
-                        suggestions=json.dumps(evaluation_result['suggestions'])
-                    )
-                    session.add(evaluation)
-                    session.commit()
-                    
-                    st.balloons()  # Celebration animation
-                    st.success("✅ Evaluation completed successfully!")
-                    st.session_state.last_evaluation = evaluation_result
-                    st.session_state.last_submission_id = submission.id
-                    
-                    # Display results
-                    display_evaluation_results(evaluation_result)
-                    
-                except Exception as e:
-                    st.error(f"❌ Error during evaluation: {str(e)}")
-                    st.exception(e)
+            except Exception as e:
+                st.error(f"❌ Error submitting for evaluation: {str(e)}")
+                st.exception(e)
+    
+    if st.session_state.get('pending_job_id'):
+        return show_job_status(st.session_state.pending_job_id)
+    return False
+
+def save_upload(student_id, uploaded_file):
+    """Save an uploaded image under uploads/ and return its path"""
+    file_path = f"uploads/{student_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{uploaded_file.name.split('.')[-1]}"
+    with open(file_path, "wb") as f:
+        f.write(uploaded_file.getbuffer())
+    return file_path
+
+def show_job_status(job_id):
+    """
+    Show the state of a queued evaluation, and its result once a worker has finished it
+    
+    Returns:
+        True while the job is still queued or running, so the caller polls again
+    """
+    job = get_queue().get(job_id)
+    if job is None:
+        del st.session_state.pending_job_id
+        return False
+    
+    if job.status in ('queued', 'running'):
+        if job.status == 'queued':
+            st.info(f"⏳ Your submission is waiting in the evaluation queue (job #{job.id})...")
+        else:
+            st.info(f"🔄 Evaluating your submission (job #{job.id})...")
+        return True
+    
+    del st.session_state.pending_job_id
+    if job.status == 'failed':
+        st.error(f"❌ Error during evaluation: {job.error}")
+        return False
+    
+    submission, evaluation = get_database().get_evaluation(job.submission_id)
+    evaluation_result = evaluation.to_result()
+    st.balloons()  # Celebration animation
+    st.success("✅ Evaluation completed successfully!")
+    st.session_state.last_evaluation = evaluation_result
+    st.session_state.last_submission_id = submission.id
+    
+    # Display results
+    display_evaluation_results(evaluation_result)
+    return False
 
 def display_evaluation_results(evaluation_result):
     """Display evaluation results in an attractive format"""
@@ -626,8 +661,6 @@ def display_evaluation_results(evaluation_result):
 def view_results_page():
     st.markdown('<h2 class="sub-header">📈 View Evaluation Results</h2>', unsafe_allow_html=True)
     
-    session = st.session_state.db.get_session()
-    
     # Search options with enhanced styling
     st.markdown("### 🔍 Search & Filter")
     col1, col2 = st.columns(2)
@@ -636,17 +669,24 @@ def view_results_page():
     with col2:
         search_type = st.selectbox("Filter by Assignment Type", ["All", "algorithm", "flowchart", "pseudocode"], help="Filter by assignment type")
     
-    # Get submissions
-    query = session.query(Submission).join(Evaluation)
-    
-    if search_student_id:
-        query = query.filter(Submission.student_id == search_student_id)
-    if search_type != "All":
-        query = query.filter(Submission.assignment_type == search_type)
-    
-    submissions = query.order_by(Submission.submitted_at.desc()).all()
+    page_size = st.selectbox("Results per page", RESULTS_PAGE_SIZES, index=1)
+    
+    # Keyset pagination: remember the cursor that starts each visited page,
+    # and start over when the filters change
+    filters = (search_student_id, search_type, page_size)
+    if st.session_state.get('results_filters') != filters:
+        st.session_state.results_filters = filters
+        st.session_state.results_cursors = [None]
+    cursors = st.session_state.results_cursors
+    
+    rows, next_cursor = get_database().get_results_page(
+        student_id=search_student_id or None,
+        assignment_type=None if search_type == "All" else search_type,
+        page_size=page_size,
+        after=cursors[-1]
+    )
     
-    if not submissions:
+    if not rows:
         st.markdown("""
             <div class="info-card" style="text-align: center; padding: 3rem;">
                 <p style="font-size: 1.5rem; color: #667eea; font-weight: 600; margin-bottom: 1rem;">
@@ -659,32 +699,55 @@ def view_results_page():
         """, unsafe_allow_html=True)
         return
     
-    # Display submissions
-    for submission in submissions:
-        with st.expander(f"📄 {submission.student_name} - {submission.assignment_type.upper()} (Submitted: {submission.submitted_at.strftime('%Y-%m-%d %H:%M')})"):
-            # Get evaluation
-            evaluation = session.query(Evaluation).filter_by(submission_id=submission.id).first()
-            
-            if evaluation:
-                eval_data = {
-                    'overall_score': evaluation.overall_score,
-                    'detailed_scores': json.loads(evaluation.detailed_scores),
-                    'feedback': evaluation.feedback,
-                    'strengths': json.loads(evaluation.strengths) if evaluation.strengths else [],
-                    'weaknesses': json.loads(evaluation.weaknesses) if evaluation.weaknesses else [],
-                    'suggestions': json.loads(evaluation.suggestions) if evaluation.suggestions else []
-                }
-                display_evaluation_results(eval_data)
-                
-                # Show submission details
-                st.markdown("### 📝 Submission Details")
-                st.text_area("Submitted Answer", submission.extracted_text or submission.original_text, height=150, disabled=True)
+    # Compact summary of this page
+    summary = pd.DataFrame([
+        {
+            'Student': row.student_name,
+            'Student ID': row.student_id,
+            'Type': row.assignment_type.upper(),
+            'Submitted': row.submitted_at.strftime('%Y-%m-%d %H:%M'),
+            'Score': round(row.overall_score, 1)
+        }
+        for row in rows
+    ])
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Previous", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.markdown(f"<p style='text-align: center;'>Page {len(cursors)}</p>", unsafe_allow_html=True)
+    with col3:
+        if st.button("Next ➡️", disabled=next_cursor is None, use_container_width=True):
+            cursors.append(next_cursor)
+            st.rerun()
+    
+    # Only the submission the user opens is loaded in full and charted
+    labels = {
+        row.submission_id: f"📄 {row.student_name} - {row.assignment_type.upper()} (Submitted: {row.submitted_at.strftime('%Y-%m-%d %H:%M')})"
+        for row in rows
+    }
+    selected = st.selectbox(
+        "Open a submission",
+        [None] + list(labels),
+        format_func=lambda submission_id: "Select a submission..." if submission_id is None else labels[submission_id]
+    )
+    if selected is not None:
+        submission, evaluation = get_database().get_evaluation(selected)
+        display_evaluation_results(evaluation.to_result())
+        
+        # Show submission details
+        st.markdown("### 📝 Submission Details")
+        st.text_area("Submitted Answer", submission.extracted_text or submission.original_text, height=150, disabled=True)
 
 def rubric_management_page():
     st.markdown('<h2 class="sub-header">📋 Rubric Management</h2>', unsafe_allow_html=True)
     
     # Display existing rubrics
-    rubrics = st.session_state.rubric_manager.get_all_rubrics()
+    rubric_manager = get_rubric_manager()
+    rubrics = rubric_manager.get_all_rubrics()
     
     st.markdown("### 📊 Current Rubrics")
     st.markdown("""
@@ -697,7 +760,7 @@ def rubric_management_page():
     
     for rubric in rubrics:
         type_icon = "🔢" if rubric['type'] == 'algorithm' else "📊" if rubric['type'] == 'flowchart' else "💻"
-        with st.expander(f"{type_icon} {rubric['name']} ({rubric['type'].upper()})"):
+        with st.expander(f"{type_icon} {rubric['name']} ({rubric['type'].upper()}, ID {rubric['id']})"):
             st.markdown("#### 📝 Criteria & Weights")
             criteria_df = pd.DataFrame({
                 'Criterion': list(rubric['criteria'].keys()),
@@ -705,16 +768,44 @@ def rubric_management_page():
                 'Weight': [f"{rubric['weights'][k]*100:.1f}%" for k in rubric['criteria'].keys()]
             })
             st.dataframe(criteria_df, use_container_width=True, hide_index=True)
+            
+            st.markdown("#### ✅ Reference Answers")
+            st.caption("Model solutions; answers that are close to one score higher on correctness, logic and completeness.")
+            for reference in rubric['references']:
+                text_col, remove_col = st.columns([5, 1])
+                with text_col:
+                    st.code(reference['text'], language=None)
+                with remove_col:
+                    if st.button("🗑️ Remove", key=f"remove_reference_{reference['id']}", use_container_width=True):
+                        rubric_manager.delete_reference_answer(reference['id'])
+                        prepare_rubric(rubric['id'])
+                        st.rerun()
+            
+            reference_text = st.text_area("Add a reference answer", key=f"reference_text_{rubric['id']}", height=150)
+            if st.button("➕ Add Reference Answer", key=f"add_reference_{rubric['id']}"):
+                if not reference_text.strip():
+                    st.error("❌ Please enter the reference answer text")
+                else:
+                    # Embedded once here, so grading only compares against the stored vector
+                    with st.spinner("🔄 Saving reference answer..."):
+                        evaluator = get_evaluator()
+                        rubric_manager.add_reference_answer(
+                            rubric['id'], reference_text,
+                            embedding=evaluator.embed_reference(reference_text),
+                            embedding_model=evaluator.model_key
+                        )
+                        prepare_rubric(rubric['id'])
+                    st.rerun()
 
 def analytics_dashboard_page():
     st.markdown('<h2 class="sub-header">📊 Analytics Dashboard</h2>', unsafe_allow_html=True)
     
-    session = st.session_state.db.get_session()
+    db = get_database()
     
-    # Get all evaluations
-    evaluations = session.query(Evaluation).all()
+    # Aggregate in SQL; only small summaries come back to the page
+    summary = db.get_score_summary()
     
-    if not evaluations:
+    if not summary['count']:
         st.markdown("""
             <div class="info-card" style="text-align: center; padding: 3rem;">
                 <p style="font-size: 1.5rem; color: #667eea; font-weight: 600; margin-bottom: 1rem;">
@@ -728,8 +819,7 @@ def analytics_dashboard_page():
         return
     
     # Statistics with enhanced cards
-    scores = [e.overall_score for e in evaluations]
-    avg_score = sum(scores) / len(scores) if scores else 0
+    avg_score = summary['average']
     
     st.markdown("### 📈 Key Statistics")
     col1, col2, col3, col4 = st.columns(4)
@@ -737,7 +827,7 @@ def analytics_dashboard_page():
         st.markdown(f"""
             <div class="score-card" style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);">
                 <div style="font-size: 1rem; opacity: 0.9;">Total Evaluations</div>
-                <div style="font-size: 2.5rem; font-weight: 800;">{len(evaluations)}</div>
+                <div style="font-size: 2.5rem; font-weight: 800;">{summary['count']}</div>
             </div>
         """, unsafe_allow_html=True)
     with col2:
@@ -748,7 +838,7 @@ def analytics_dashboard_page():
             </div>
         """, unsafe_allow_html=True)
     with col3:
-        max_score = max(scores) if scores else 0
+        max_score = summary['max']
         st.markdown(f"""
             <div class="score-card" style="background: linear-gradient(135deg, #f59e0b 0%, #d97706 100%);">
                 <div style="font-size: 1rem; opacity: 0.9;">Highest Score</div>
@@ -756,7 +846,7 @@ def analytics_dashboard_page():
             </div>
         """, unsafe_allow_html=True)
     with col4:
-        min_score = min(scores) if scores else 0
+        min_score = summary['min']
         st.markdown(f"""
             <div class="score-card" style="background: linear-gradient(135deg, #ef4444 0%, #dc2626 100%);">
                 <div style="font-size: 1rem; opacity: 0.9;">Lowest Score</div>
@@ -766,17 +856,23 @@ def analytics_dashboard_page():
     
     # Score distribution
     st.markdown("### 📊 Score Distribution")
-    df_scores = pd.DataFrame({'Score': scores})
-    fig = px.histogram(
+    bucket_size = 5
+    histogram = db.get_score_histogram(bucket_size=bucket_size)
+    df_scores = pd.DataFrame({
+        'Score': [start + bucket_size / 2 for start, _ in histogram],
+        'Count': [count for _, count in histogram]
+    })
+    fig = px.bar(
         df_scores, 
         x='Score', 
-        nbins=20, 
+        y='Count', 
         title="📈 Distribution of Scores",
-        labels={'Score': 'Score (out of 100)', 'count': 'Number of Submissions'},
+        labels={'Score': 'Score (out of 100)', 'Count': 'Number of Submissions'},
         color_discrete_sequence=['#667eea']
     )
     fig.update_layout(
         height=450,
+        bargap=0,
         plot_bgcolor='rgba(0,0,0,0)',
         paper_bgcolor='rgba(0,0,0,0)',
         font=dict(family="Poppins", size=12),
@@ -788,18 +884,10 @@ def analytics_dashboard_page():
     
     # Performance by assignment type
     st.markdown("### 📋 Performance by Assignment Type")
-    type_scores = {}
-    for eval_obj in evaluations:
-        submission = session.query(Submission).filter_by(id=eval_obj.submission_id).first()
-        if submission:
-            if submission.assignment_type not in type_scores:
-                type_scores[submission.assignment_type] = []
-            type_scores[submission.assignment_type].append(eval_obj.overall_score)
-    
-    type_avg = {k: sum(v)/len(v) for k, v in type_scores.items()}
+    type_averages = db.get_type_averages()
     df_type = pd.DataFrame({
-        'Assignment Type': [t.upper() for t in type_avg.keys()],
-        'Average Score': list(type_avg.values())
+        'Assignment Type': [t.upper() for t, _, _ in type_averages],
+        'Average Score': [average for _, average, _ in type_averages]
     })
     fig = px.bar(
         df_type, 
@@ -822,6 +910,65 @@ def analytics_dashboard_page():
     fig.update_traces(marker_line_width=2, marker_line_color='white')
     st.plotly_chart(fig, use_container_width=True)
 
+def performance_page():
+    st.markdown('<h2 class="sub-header">⚡ Performance</h2>', unsafe_allow_html=True)
+    
+    if not metrics.registry.enabled:
+        st.info("ℹ️ Latency metrics are turned off (EVALUATOR_METRICS=0).")
+        return
+    
+    st.markdown("""
+        <div class="info-card">
+            <p style="margin: 0; font-size: 1.1rem; color: #667eea; font-weight: 600;">
+                ⏱️ Time spent in each stage of the submission pipeline since this app process started
+            </p>
+        </div>
+    """, unsafe_allow_html=True)
+    
+    stages = metrics.registry.summary()
+    if not stages:
+        st.info("No timings recorded yet. Submit or view some assignments first.")
+        return
+    
+    df_stages = pd.DataFrame([
+        {
+            'Stage': stage['stage'],
+            'Calls': stage['count'],
+            'Total (s)': round(stage['total_s'], 2),
+            'Mean (ms)': round(stage['mean_s'] * 1000, 1),
+            'p50 (ms)': round(stage['p50_s'] * 1000, 1),
+            'p95 (ms)': round(stage['p95_s'] * 1000, 1),
+            'p99 (ms)': round(stage['p99_s'] * 1000, 1)
+        }
+        for stage in stages
+    ])
+    st.dataframe(df_stages, use_container_width=True, hide_index=True)
+    
+    fig = px.bar(
+        df_stages.sort_values('Total (s)'),
+        x='Total (s)',
+        y='Stage',
+        orientation='h',
+        title="⏱️ Total Time by Stage"
+    )
+    fig.update_layout(height=max(300, 30 * len(df_stages)), plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)')
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.caption("Percentiles are estimated from histogram buckets. Worker processes started with "
+               "`python jobs.py` keep their own metrics; serve them with `--metrics-port`.")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            "📥 Download Prometheus metrics",
+            metrics.registry.to_prometheus(),
+            file_name="evaluator_metrics.prom",
+            mime="text/plain",
+            use_container_width=True
+        )
+    with col2:
+        if st.button("🔄 Reset metrics", use_container_width=True):
+            metrics.registry.reset()
+            st.rerun()
+
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,334 @@
+"""
+Offline benchmark suite over a synthetic, reproducible submission corpus
+
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --only preprocess,db
+
+Times OCR, preprocessing per method, evaluation and the database paths, and
+writes throughput and p50/p95 latency per benchmark as JSON. Each component
+runs in its own process, so its peak RSS is reported separately.
+Components whose dependencies are missing (Tesseract, a cached transformer
+model) are reported as skipped, so runs on different machines stay comparable.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Never download models during a benchmark run
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+
+import cv2
+import numpy as np
+
+COMPONENTS = ('preprocess', 'ocr', 'evaluate', 'db')
+ASSIGNMENT_TYPES = ('algorithm', 'flowchart', 'pseudocode')
+
+# Image variants rendered for every corpus text: page width in pixels, blur sigma
+RESOLUTIONS = (640, 1280, 2560)
+BLUR_LEVELS = (0.0, 1.5, 3.0)
+
+_VARIABLES = ['n', 'count', 'total', 'value', 'index', 'result', 'maximum', 'item']
+_CONDITIONS = ['{a} > {b}', '{a} == 0', '{a} < {b}', '{a} % 2 == 0']
+_ACTIONS = ['PRINT {a}', 'SET {a} = {a} + 1', 'SET {a} = {b} * 2', 'ADD {a} TO {b}', 'RETURN {a}']
+
+def generate_text(rng, assignment_type):
+    """One synthetic answer: a short structured program in the style of the assignment type"""
+    a, b, c = rng.sample(_VARIABLES, 3)
+    fill = lambda template: template.format(a=rng.choice((a, b, c)), b=rng.choice((a, b, c)))
+    body = []
+    for _ in range(rng.randint(2, 4)):
+        kind = rng.random()
+        if kind < 0.4:
+            body += [f"IF {fill(rng.choice(_CONDITIONS))} THEN", f"  {fill(rng.choice(_ACTIONS))}",
+                     "ELSE", f"  {fill(rng.choice(_ACTIONS))}", "END IF"]
+        elif kind < 0.7:
+            body += [f"FOR {a} FROM 1 TO {b}", f"  {fill(rng.choice(_ACTIONS))}", "END FOR"]
+        else:
+            body += [f"WHILE {fill(rng.choice(_CONDITIONS))}", f"  {fill(rng.choice(_ACTIONS))}", "END WHILE"]
+    
+    if assignment_type == 'algorithm':
+        steps = [f"Step {i}: {line.strip()}" for i, line in enumerate([f"Read {a} and {b}"] + body, start=1)]
+        return "\n".join(steps + [f"Step {len(steps) + 1}: Stop"])
+    if assignment_type == 'flowchart':
+        return "\n".join(["START", f"INPUT {a}, {b}"] + [line.strip() for line in body] + ["OUTPUT result", "END"])
+    return "\n".join(["BEGIN", f"  READ {a}, {b}"] + [f"  {line}" for line in body] + ["END"])
+
+def generate_corpus(count, seed=0):
+    """Reproducible list of (assignment_type, text) pairs"""
+    rng = random.Random(seed)
+    return [
+        (assignment_type, generate_text(rng, assignment_type))
+        for assignment_type in (ASSIGNMENT_TYPES[i % len(ASSIGNMENT_TYPES)] for i in range(count))
+    ]
+
+def render_image(text, width=1280, blur=0.0):
+    """Render text as a scanned-looking page and return it PNG-encoded"""
+    lines = text.split("\n")
+    # Lay out at a fixed size, then resample to the requested resolution
+    page = np.full((60 + 40 * len(lines), 900), 255, dtype=np.uint8)
+    for i, line in enumerate(lines):
+        cv2.putText(page, line, (30, 50 + 40 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.9, 0, 2, cv2.LINE_AA)
+    height = int(page.shape[0] * width / page.shape[1])
+    page = cv2.resize(page, (width, height), interpolation=cv2.INTER_AREA if width < 900 else cv2.INTER_CUBIC)
+    if blur > 0:
+        page = cv2.GaussianBlur(page, (0, 0), blur)
+    ok, encoded = cv2.imencode('.png', page)
+    return encoded.tobytes()
+
+def generate_images(corpus, resolutions=RESOLUTIONS, blur_levels=BLUR_LEVELS):
+    """Rendered variants of the corpus: list of (label, png_bytes)"""
+    return [
+        (f"{assignment_type}_{width}px_blur{blur}", render_image(text, width, blur))
+        for assignment_type, text in corpus
+        for width in resolutions
+        for blur in blur_levels
+    ]
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, or None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def summarize(latencies, items=None):
+    """Throughput and latency percentiles for a list of per-call seconds"""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = float(latencies.sum())
+    items = items if items is not None else len(latencies)
+    return {
+        'calls': len(latencies),
+        'items': items,
+        'total_s': round(total, 4),
+        'throughput_per_s': round(items / total, 2) if total > 0 else None,
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 3),
+        'mean_ms': round(float(latencies.mean()) * 1000, 3)
+    }
+
+def measure(func, inputs, repeats=1, size=None):
+    """
+    Call func on every input, repeats times, and summarize the latencies
+    
+    Args:
+        size: Number of items in an input, for batch calls (default: 1 each)
+    """
+    latencies = []
+    items = 0
+    for _ in range(repeats):
+        for value in inputs:
+            start = time.perf_counter()
+            func(value)
+            latencies.append(time.perf_counter() - start)
+            items += size(value) if size else 1
+    return summarize(latencies, items=items)
+
+def bench_preprocess(images, repeats):
+    from ocr_processor import OCRProcessor, PREPROCESS_METHODS
+    ocr = OCRProcessor(max_workers=1)
+    data = [png for _, png in images]
+    return {
+        f"preprocess_image[{method}]": measure(lambda png: ocr.preprocess_image(png, method), data, repeats)
+        for method in PREPROCESS_METHODS
+    }
+
+def bench_ocr(images, repeats):
+    import pytesseract
+    from ocr_processor import OCRProcessor
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        raise RuntimeError(f"Tesseract is not available: {e}")
+    
+    data = [png for _, png in images]
+    results = {}
+    for search_mode in ('grid', 'adaptive'):
+        ocr = OCRProcessor(search_mode=search_mode)
+        results[f"extract_with_confidence[{search_mode}]"] = measure(ocr.extract_with_confidence, data, repeats)
+    return results
+
+def bench_evaluate(corpus, repeats, backend=None):
+    from evaluator import IntelligentEvaluator
+    from rubric_manager import RubricManager
+    from database import Database
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        rubric_manager = RubricManager(db)
+        try:
+            load_start = time.perf_counter()
+            evaluator = IntelligentEvaluator(cache_dir=os.path.join(tmp, 'embeddings'), backend=backend)
+            load_s = time.perf_counter() - load_start
+        except (OSError, ValueError) as e:
+            db.close()
+            raise RuntimeError(f"Transformer model is not cached locally: {e}")
+        
+        by_type = {}
+        for assignment_type, text in corpus:
+            by_type.setdefault(assignment_type, []).append(text)
+        rubrics = {t: rubric_manager.get_rubric(t) for t in by_type}
+        evaluator.prepare_rubrics(rubrics.values())
+        
+        pairs = [(text, rubrics[t]) for t, text in corpus]
+        results = {
+            'model_load': {'total_s': round(load_s, 4)},
+            'evaluate': measure(lambda pair: evaluator.evaluate(*pair), pairs, repeats),
+            'evaluate_batch': measure(
+                lambda t: evaluator.evaluate_batch(by_type[t], rubrics[t]),
+                list(by_type), repeats, size=lambda t: len(by_type[t])
+            )
+        }
+        db.close()
+    return results
+
+def bench_db(corpus, repeats):
+    from database import Database
+    from rubric_manager import RubricManager
+    
+    result = {
+        'overall_score': 72.5,
+        'detailed_scores': {c: {'score': 70, 'max_score': 100, 'feedback': 'Adequate'} for c in ('logic', 'syntax', 'clarity')},
+        'feedback': 'Good work overall.',
+        'strengths': ['logic: Adequate'],
+        'weaknesses': [],
+        'suggestions': []
+    }
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        rubric_manager = RubricManager(db)
+        records = [
+            (
+                {'student_id': f"STU{i:05d}", 'student_name': f"Student {i}", 'assignment_type': assignment_type,
+                 'extracted_text': text, 'original_text': text},
+                rubric_manager.get_rubric(assignment_type)['id'],
+                result
+            )
+            for i, (assignment_type, text) in enumerate(corpus * 10)
+        ]
+        
+        results = {
+            'save_evaluation': measure(lambda record: db.save_evaluation(*record), records[:200], repeats),
+            'save_evaluations[500]': measure(
+                db.save_evaluations, [records[i:i + 500] for i in range(0, len(records), 500)], repeats,
+                size=len
+            )
+        }
+        
+        # Reads against a table of a few thousand rows
+        while len(records) < 5000:
+            records = records * 2
+        db.save_evaluations(records[:5000])
+        _, cursor = db.get_results_page(page_size=25)
+        submission_ids = [row.submission_id for row in db.get_results_page(page_size=100)[0]]
+        results.update({
+            'get_results_page[first]': measure(lambda _: db.get_results_page(page_size=25), range(50), repeats),
+            'get_results_page[next]': measure(lambda _: db.get_results_page(page_size=25, after=cursor), range(50), repeats),
+            'get_evaluation': measure(db.get_evaluation, submission_ids, repeats),
+            'get_score_summary': measure(lambda _: db.get_score_summary(), range(20), repeats),
+            'get_score_histogram': measure(lambda _: db.get_score_histogram(), range(20), repeats),
+            'rubric_lookup': measure(lambda t: rubric_manager.get_rubric(t), list(ASSIGNMENT_TYPES) * 1000, repeats)
+        })
+        db.close()
+    return results
+
+def run_component(component, corpus, images, args):
+    """
+    Run one component's benchmarks
+    
+    Returns:
+        Tuple of (results, peak RSS in MB of the process); called in a fresh
+        process per component, so the peak covers only that component
+    """
+    benchmarks = {
+        'preprocess': lambda: bench_preprocess(images, args.repeats),
+        'ocr': lambda: bench_ocr(images, args.repeats),
+        'evaluate': lambda: bench_evaluate(corpus, args.repeats, args.backend),
+        'db': lambda: bench_db(corpus, args.repeats)
+    }
+    try:
+        results = benchmarks[component]()
+    except (ImportError, RuntimeError) as e:
+        print(f"Skipping {component}: {e}", file=sys.stderr)
+        results = {'skipped': str(e)}
+    return results, peak_rss_mb()
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR, preprocessing, evaluation and database paths")
+    parser.add_argument('--output', '-o', help="JSON report path (default: print to stdout)")
+    parser.add_argument('--only', help=f"comma-separated components to run ({', '.join(COMPONENTS)})")
+    parser.add_argument('--count', type=int, default=30, help="texts in the synthetic corpus")
+    parser.add_argument('--images', type=int, default=3, help="corpus texts rendered as images")
+    parser.add_argument('--repeats', type=int, default=1, help="passes over the inputs per benchmark")
+    parser.add_argument('--seed', type=int, default=0, help="corpus seed")
+    parser.add_argument('--backend', default=None, help="evaluator inference backend")
+    parser.add_argument('--quick', action='store_true', help="small corpus and fewer image variants, for smoke runs")
+    args = parser.parse_args()
+    
+    components = args.only.split(',') if args.only else list(COMPONENTS)
+    unknown = set(components) - set(COMPONENTS)
+    if unknown:
+        parser.error(f"unknown components: {', '.join(sorted(unknown))}")
+    
+    count, n_images, resolutions, blur_levels = args.count, args.images, RESOLUTIONS, BLUR_LEVELS
+    if args.quick:
+        count, n_images, resolutions, blur_levels = min(count, 6), 1, RESOLUTIONS[:2], BLUR_LEVELS[:2]
+    
+    corpus = generate_corpus(count, args.seed)
+    images = generate_images(corpus[:n_images], resolutions, blur_levels) if {'preprocess', 'ocr'} & set(components) else []
+    
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'corpus_texts': len(corpus),
+            'corpus_images': len(images),
+            'resolutions': list(resolutions),
+            'blur_levels': list(blur_levels),
+            'repeats': args.repeats
+        },
+        'results': {},
+        'peak_rss_mb': {}
+    }
+    # A spawned process per component keeps earlier components' memory
+    # (e.g. a loaded model) out of the next one's peak RSS
+    context = multiprocessing.get_context('spawn')
+    for component in components:
+        print(f"Running {component} benchmarks...", file=sys.stderr)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results, peak = executor.submit(run_component, component, corpus, images, args).result()
+        report['results'][component] = results
+        report['peak_rss_mb'][component] = peak
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
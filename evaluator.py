@@ -2,17 +2,181 @@
 Transformer-based semantic evaluation engine
 """
 import json
+import hashlib
+import os
+import threading
 import numpy as np
+import torch
+from keyword_matcher import get_matcher
+from metrics import span, timed
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import re
 
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Inference backends for the embedding model; EVALUATOR_BACKEND sets the default
+BACKENDS = ('torch', 'int8', 'onnx')
+BACKEND_ENV = 'EVALUATOR_BACKEND'
+
+# Keywords the rubric heuristics look for, by heuristic (and assignment type
+# where they differ). A rubric's own 'keywords' for a criterion replace these.
+HEURISTIC_KEYWORDS = {
+    'correctness': {
+        'algorithm': ['start', 'end', 'input', 'output', 'process', 'return'],
+        'flowchart': ['start', 'end', 'decision', 'process', 'input', 'output'],
+        'pseudocode': ['begin', 'end', 'if', 'then', 'else', 'while', 'for', 'function']
+    },
+    'syntax': ['begin', 'end', 'if', 'then', 'else', 'while', 'for', 'function', 'procedure'],
+    'efficiency': ['complexity', 'time', 'space', 'optimize', 'efficient', 'algorithm'],
+    'symbols': ['start', 'end', 'decision', 'process', 'input', 'output', 'connector']
+}
+
+# Criteria scored by each keyword heuristic
+KEYWORD_HEURISTICS = {
+    'correctness': 'correctness',
+    'logic': 'correctness',
+    'syntax': 'syntax',
+    'efficiency': 'efficiency',
+    'symbols': 'symbols'
+}
+
+# Criteria about what an answer says, scored partly on its closeness to the
+# rubric's reference answers, and the share of their similarity taken from it
+REFERENCE_CRITERIA = ('correctness', 'logic', 'completeness')
+REFERENCE_WEIGHT = 0.5
+
+def load_model(model_name=MODEL_NAME, backend='torch'):
+    """
+    Load the sentence embedding model for an inference backend
+    
+    'torch' runs the fp32 PyTorch model, 'int8' quantizes its linear layers
+    with dynamic int8 quantization for CPU, and 'onnx' runs it through
+    ONNX Runtime (needs optimum[onnxruntime]).
+    """
+    if backend == 'torch':
+        return SentenceTransformer(model_name)
+    if backend == 'int8':
+        model = SentenceTransformer(model_name, device='cpu')
+        # In place, so the fp32 weights are released instead of copied
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if backend == 'onnx':
+        try:
+            return SentenceTransformer(model_name, device='cpu', backend='onnx')
+        except ImportError as e:
+            raise ImportError(f"The onnx backend needs optimum[onnxruntime]: {e}")
+    raise ValueError(f"Unknown inference backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+class CriterionEmbeddingCache:
+    """Criterion description embeddings per rubric, kept in memory and in sidecar files"""
+    
+    def __init__(self, model, model_name=MODEL_NAME, cache_dir='embedding_cache'):
+        self.model = model
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self._embeddings = {}
+        self._lock = threading.Lock()
+    
+    def _rubric_key(self, rubric):
+        """
+        Key a rubric by id and model plus a hash of its criterion descriptions
+        
+        The prefix names the files of one rubric for one model, so processes
+        running different backends on a shared cache folder keep their own.
+        """
+        payload = json.dumps([self.model_name, list(rubric['criteria'].items())])
+        digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+        rubric_id = rubric.get('id')
+        if rubric_id is None:
+            return None, digest
+        model = re.sub(r'[^\w.-]', '_', self.model_name)
+        return f"rubric_{rubric_id}_{model}", digest
+    
+    def get(self, rubric):
+        """Return the unit-normalized criterion embedding matrix for a rubric"""
+        prefix, digest = self._rubric_key(rubric)
+        key = (prefix, digest)
+        
+        embeddings = self._embeddings.get(key)
+        if embeddings is not None:
+            return embeddings
+        
+        with self._lock:
+            # Rubrics without an id (ad hoc ones) are only kept in memory
+            embeddings = self._embeddings.get(key)
+            if embeddings is None and prefix is not None:
+                embeddings = self._load(prefix, digest)
+            if embeddings is None:
+                descriptions = list(rubric['criteria'].values())
+                with span('evaluate.encode_criteria'):
+                    embeddings = self.model.encode(descriptions, normalize_embeddings=True)
+                if prefix is not None:
+                    self._store(prefix, digest, embeddings)
+            self._embeddings[key] = embeddings
+        return embeddings
+    
+    def _path(self, prefix, digest):
+        return os.path.join(self.cache_dir, f"{prefix}_{digest}.npy")
+    
+    def _load(self, prefix, digest):
+        """Load persisted embeddings, ignoring missing or unreadable files"""
+        path = self._path(prefix, digest)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path)
+        except (OSError, ValueError):
+            return None
+    
+    def _store(self, prefix, digest, embeddings):
+        """Persist embeddings and drop stale files for the same rubric"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(prefix, digest)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, embeddings)
+            os.replace(tmp_path, path)
+            
+            # Criteria changed for this rubric: old embeddings from this model are invalid
+            stale = re.compile(rf"{re.escape(prefix)}_[0-9a-f]{{16}}\.npy")
+            for name in os.listdir(self.cache_dir):
+                if stale.fullmatch(name) and name != os.path.basename(path):
+                    os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass  # The in-memory copy is still usable
+
 class IntelligentEvaluator:
-    def __init__(self):
+    def __init__(self, cache_dir='embedding_cache', backend=None):
+        """
+        Args:
+            cache_dir: Folder for persisted criterion embeddings
+            backend: Inference backend from BACKENDS; defaults to EVALUATOR_BACKEND or 'torch'
+        """
+        self.backend = backend or os.environ.get(BACKEND_ENV) or 'torch'
+        
         # Load pre-trained transformer model for semantic similarity
-        print("Loading transformer model...")
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        print(f"Loading transformer model ({self.backend} backend)...")
+        self.model = load_model(MODEL_NAME, self.backend)
         print("Model loaded successfully!")
+        
+        # Criterion embeddings are computed once per rubric and reused; each
+        # backend produces slightly different vectors, so it is part of the key
+        self.model_key = f"{MODEL_NAME}:{self.backend}"
+        self.criterion_cache = CriterionEmbeddingCache(self.model, self.model_key, cache_dir)
+        
+        # Reference answer matrices by (rubric ID, reference IDs)
+        self._reference_matrices = {}
+        self._reference_lock = threading.Lock()
+    
+    def prepare_rubrics(self, rubrics):
+        """Precompute criterion and reference embeddings for rubrics as they are created or loaded"""
+        for rubric in rubrics:
+            self.criterion_cache.get(rubric)
+            self._reference_matrix(rubric)
+    
+    def embed_reference(self, text):
+        """Embedding of a reference answer, computed once and stored with it"""
+        return self.model.encode([self._normalize_text(text)], normalize_embeddings=True)[0].astype(np.float32)
     
     def evaluate(self, student_answer, rubric, reference_answer=None):
         """
@@ -21,11 +185,56 @@ class IntelligentEvaluator:
         Args:
             student_answer: Text extracted from student's submission
             rubric: Rubric dictionary with criteria and weights
-            reference_answer: Optional reference answer for comparison
+            reference_answer: Optional reference answer for comparison, used
+                alongside the rubric's stored reference answers
         
         Returns:
             Dictionary with scores, feedback, strengths, weaknesses, suggestions
         """
+        # A single answer is a batch of one, so both paths score identically
+        return self.evaluate_batch([student_answer], rubric, [reference_answer])[0]
+    
+    @timed('evaluate.batch')
+    def evaluate_batch(self, answers, rubric, reference_answers=None, batch_size=64):
+        """
+        Evaluate many student answers against the same rubric
+        
+        Args:
+            answers: List of student answer texts
+            rubric: Rubric dictionary with criteria and weights
+            reference_answers: Optional list of extra reference answers, one per answer
+            batch_size: Number of answers per transformer forward pass
+        
+        Returns:
+            List of evaluation dictionaries in the same order as answers
+        """
+        answers = list(answers)
+        if reference_answers is None:
+            reference_answers = [None] * len(answers)
+        elif len(reference_answers) != len(answers):
+            raise ValueError("reference_answers must have one entry per answer")
+        
+        # Normalize student answers
+        student_texts = [self._normalize_text(answer) for answer in answers]
+        
+        # Embed all answers in large batches and score every criterion at once
+        scorable, student_embeddings = self._embed_answers(student_texts, batch_size)
+        similarities = self._criterion_similarities(scorable, student_embeddings, rubric, len(student_texts))
+        reference_similarities = self._reference_similarities(
+            scorable, student_embeddings, rubric, reference_answers, len(student_texts)
+        )
+        keyword_fractions = self._keyword_fractions(student_texts, rubric)
+        
+        return [
+            self._score_answer(student_text, rubric, answer_similarities, reference_similarity, answer_keywords)
+            for student_text, answer_similarities, reference_similarity, answer_keywords
+            in zip(student_texts, similarities, reference_similarities, keyword_fractions)
+        ]
+    
+    def _score_answer(self, student_text, rubric, similarities, reference_similarity=None, keyword_fractions=None):
+        """Build the evaluation result for one answer from its criterion and reference similarities"""
+        if keyword_fractions is None:
+            keyword_fractions = self._keyword_fractions([student_text], rubric)[0]
         criteria = rubric['criteria']
         weights = rubric['weights']
         assignment_type = rubric['type']
@@ -35,17 +244,16 @@ class IntelligentEvaluator:
         weaknesses = []
         suggestions = []
         
-        # Normalize student answer
-        student_text = self._normalize_text(student_answer)
-        
         # Evaluate each criterion
-        for criterion, description in criteria.items():
+        for (criterion, description), similarity, keyword_fraction in zip(criteria.items(), similarities, keyword_fractions):
             score, feedback = self._evaluate_criterion(
                 student_text, 
                 criterion, 
                 description, 
                 assignment_type,
-                reference_answer
+                similarity,
+                None if reference_similarity is None or np.isnan(reference_similarity) else reference_similarity,
+                None if np.isnan(keyword_fraction) else keyword_fraction
             )
             detailed_scores[criterion] = {
                 'score': score,
@@ -100,63 +308,196 @@ class IntelligentEvaluator:
         
         return text.strip()
     
-    def _evaluate_criterion(self, student_text, criterion, description, assignment_type, reference_answer=None):
-        """Evaluate a specific criterion using semantic similarity"""
+    def _is_too_short(self, student_text):
+        """Check whether an answer is too short to be evaluated"""
+        return not student_text or len(student_text.strip()) < 10
+    
+    def _embed_answers(self, student_texts, batch_size=64):
+        """
+        Unit-normalized embeddings of the answers long enough to score
         
-        if not student_text or len(student_text.strip()) < 10:
-            return 0, "Answer is too short or empty. Please provide a complete solution."
+        Returns:
+            (indices of the embedded answers, matrix of their embeddings)
+        """
+        # Answers that are too short score zero on every criterion anyway
+        scorable = [i for i, text in enumerate(student_texts) if not self._is_too_short(text)]
+        if not scorable:
+            return scorable, None
+        
+        # Only the answers need a forward pass; criteria and references are cached
+        with span('evaluate.encode'):
+            student_embeddings = self.model.encode(
+                [student_texts[i] for i in scorable],
+                batch_size=batch_size,
+                normalize_embeddings=True
+            )
+        return scorable, student_embeddings
+    
+    def _criterion_similarities(self, scorable, student_embeddings, rubric, num_answers):
+        """Cosine similarity matrix of shape (answers, criteria)"""
+        similarities = np.zeros((num_answers, len(rubric['criteria'])), dtype=np.float32)
+        if not scorable:
+            return similarities
+        criterion_embeddings = self.criterion_cache.get(rubric)
+        
+        # Embeddings are unit length, so the dot product is the cosine similarity
+        similarities[scorable] = student_embeddings @ criterion_embeddings.T
+        return similarities
+    
+    def _reference_matrix(self, rubric):
+        """Unit-normalized embeddings of a rubric's reference answers, or None if it has none"""
+        references = rubric.get('references') or ()
+        if not references:
+            return None
+        key = (rubric.get('id'), tuple(reference['id'] for reference in references))
+        
+        matrix = self._reference_matrices.get(key)
+        if matrix is not None:
+            return matrix
+        
+        with self._reference_lock:
+            matrix = self._reference_matrices.get(key)
+            if matrix is None:
+                rows = [reference['embedding'] for reference in references]
+                
+                # Embeddings saved by another model or backend don't compare; encode those once here
+                stale = [
+                    i for i, reference in enumerate(references)
+                    if reference['embedding'] is None or reference['embedding_model'] != self.model_key
+                ]
+                if stale:
+                    with span('evaluate.encode_references'):
+                        encoded = self.model.encode(
+                            [self._normalize_text(references[i]['text']) for i in stale],
+                            normalize_embeddings=True
+                        )
+                    for i, embedding in zip(stale, encoded):
+                        rows[i] = embedding
+                matrix = np.vstack(rows).astype(np.float32)
+                
+                # References of this rubric changed: drop its previous matrix
+                self._reference_matrices = {
+                    cached_key: cached for cached_key, cached in self._reference_matrices.items()
+                    if cached_key[0] != key[0]
+                }
+                self._reference_matrices[key] = matrix
+        return matrix
+    
+    def _reference_similarities(self, scorable, student_embeddings, rubric, reference_answers, num_answers):
+        """
+        Similarity of each answer to its closest reference answer
         
-        # Create semantic embeddings
-        criterion_embedding = self.model.encode(description)
-        student_embedding = self.model.encode(student_text)
+        Returns:
+            Vector of length answers; NaN where an answer has no reference to compare with
+        """
+        similarities = np.full(num_answers, np.nan, dtype=np.float32)
+        if not scorable:
+            return similarities
+        
+        # Every answer against every stored reference in one product
+        reference_matrix = self._reference_matrix(rubric)
+        if reference_matrix is not None:
+            similarities[scorable] = (student_embeddings @ reference_matrix.T).max(axis=1)
+        
+        # Reference answers passed in with the answers, each distinct one encoded once
+        extra = {i: reference_answers[i] for i in scorable if (reference_answers[i] or '').strip()}
+        if extra:
+            texts = {text: position for position, text in enumerate(dict.fromkeys(extra.values()))}
+            with span('evaluate.encode_references'):
+                embeddings = self.model.encode(
+                    [self._normalize_text(text) for text in texts],
+                    normalize_embeddings=True
+                )
+            rows = {i: position for position, i in enumerate(scorable)}
+            for i, text in extra.items():
+                similarity = float(student_embeddings[rows[i]] @ embeddings[texts[text]])
+                similarities[i] = similarity if np.isnan(similarities[i]) else max(similarities[i], similarity)
+        return similarities
+    
+    def _criterion_keywords(self, criterion, rubric):
+        """Keywords checked for a criterion: the rubric's own, else the heuristic's defaults"""
+        declared = (rubric.get('keywords') or {}).get(criterion)
+        if declared is not None:
+            return declared
+        keywords = HEURISTIC_KEYWORDS.get(KEYWORD_HEURISTICS.get(criterion), ())
+        if isinstance(keywords, dict):
+            keywords = keywords.get(rubric['type'], ())
+        return keywords
+    
+    def _keyword_fractions(self, student_texts, rubric):
+        """
+        Share of each criterion's keywords found in each answer
         
-        # Base similarity score
-        similarity = cosine_similarity(
-            [criterion_embedding], 
-            [student_embedding]
-        )[0][0]
+        Returns:
+            Matrix of shape (answers, criteria); NaN where a criterion has no keywords
+        """
+        fractions = np.full((len(student_texts), len(rubric['criteria'])), np.nan)
+        for column, criterion in enumerate(rubric['criteria']):
+            keywords = self._criterion_keywords(criterion, rubric)
+            if keywords:
+                fractions[:, column] = get_matcher(keywords).fraction_batch(student_texts)
+        return fractions
+    
+    def _evaluate_criterion(self, student_text, criterion, description, assignment_type, similarity,
+                            reference_similarity=None, keyword_fraction=None):
+        """
+        Evaluate a specific criterion using its precomputed semantic similarity
+        
+        reference_similarity is the answer's similarity to its closest reference
+        answer, or None without references. keyword_fraction is the share of
+        the criterion's keywords found in the answer, or None when the
+        criterion has no keywords.
+        """
+        
+        if self._is_too_short(student_text):
+            return 0, "Answer is too short or empty. Please provide a complete solution."
+        
+        # A model solution says more about content than the criterion's description does
+        if reference_similarity is not None and criterion in REFERENCE_CRITERIA:
+            similarity = (1 - REFERENCE_WEIGHT) * similarity + REFERENCE_WEIGHT * reference_similarity
         
         # Criterion-specific evaluation
         score = 0
         feedback = ""
         
         if criterion == "correctness" or criterion == "logic":
-            score, feedback = self._evaluate_correctness(student_text, similarity, assignment_type)
+            score, feedback = self._evaluate_correctness(student_text, similarity, assignment_type, keyword_fraction or 0)
         elif criterion == "completeness":
             score, feedback = self._evaluate_completeness(student_text, similarity, assignment_type)
         elif criterion == "clarity" or criterion == "readability":
             score, feedback = self._evaluate_clarity(student_text, similarity, assignment_type)
         elif criterion == "syntax":
-            score, feedback = self._evaluate_syntax(student_text, similarity, assignment_type)
+            score, feedback = self._evaluate_syntax(student_text, similarity, assignment_type, keyword_fraction or 0)
         elif criterion == "efficiency":
-            score, feedback = self._evaluate_efficiency(student_text, similarity, assignment_type)
+            score, feedback = self._evaluate_efficiency(student_text, similarity, assignment_type, keyword_fraction or 0)
         elif criterion == "symbols":
-            score, feedback = self._evaluate_symbols(student_text, similarity, assignment_type)
+            score, feedback = self._evaluate_symbols(student_text, similarity, assignment_type, keyword_fraction or 0)
         elif criterion == "structure" or criterion == "formatting":
             score, feedback = self._evaluate_structure(student_text, similarity, assignment_type)
+        elif keyword_fraction is not None:
+            # Custom criterion with its own keywords
+            score = int(similarity * 100)
+            feedback = f"Evaluation based on key terms and semantic similarity: {description}"
         else:
             # Generic evaluation based on similarity
             score = int(similarity * 100)
             feedback = f"Evaluation based on semantic similarity: {description}"
         
+        # Keywords a rubric declares for a criterion whose heuristic doesn't
+        # check any (completeness, clarity, structure or a custom one) make up
+        # 30% of its score, as they do for correctness
+        if keyword_fraction is not None and criterion not in KEYWORD_HEURISTICS:
+            score = int(score * 0.7 + keyword_fraction * 30)
+        
         # Ensure score is between 0 and 100
         score = max(0, min(100, score))
         
         return score, feedback
     
-    def _evaluate_correctness(self, text, similarity, assignment_type):
+    def _evaluate_correctness(self, text, similarity, assignment_type, keyword_fraction):
         """Evaluate correctness of the solution"""
-        # Check for common algorithm patterns
-        keywords = {
-            'algorithm': ['start', 'end', 'input', 'output', 'process', 'return'],
-            'flowchart': ['start', 'end', 'decision', 'process', 'input', 'output'],
-            'pseudocode': ['begin', 'end', 'if', 'then', 'else', 'while', 'for', 'function']
-        }
-        
-        relevant_keywords = keywords.get(assignment_type, [])
-        found_keywords = sum(1 for kw in relevant_keywords if kw in text)
-        
-        keyword_score = (found_keywords / len(relevant_keywords)) * 30 if relevant_keywords else 0
+        # Share of common algorithm patterns present
+        keyword_score = keyword_fraction * 30
         similarity_score = similarity * 70
         
         score = int(keyword_score + similarity_score)
@@ -188,13 +529,10 @@ class IntelligentEvaluator:
         
         return score, feedback
     
-    def _evaluate_syntax(self, text, similarity, assignment_type):
+    def _evaluate_syntax(self, text, similarity, assignment_type, keyword_fraction):
         """Evaluate syntax for pseudocode"""
-        # Check for proper pseudocode syntax
-        syntax_markers = ['begin', 'end', 'if', 'then', 'else', 'while', 'for', 'function', 'procedure']
-        found_markers = sum(1 for marker in syntax_markers if marker in text)
-        
-        syntax_score = (found_markers / len(syntax_markers)) * 60 if syntax_markers else 0
+        # Share of pseudocode syntax markers present
+        syntax_score = keyword_fraction * 60
         similarity_score = similarity * 40
         
         score = int(syntax_score + similarity_score)
@@ -202,13 +540,10 @@ class IntelligentEvaluator:
         
         return score, feedback
     
-    def _evaluate_efficiency(self, text, similarity, assignment_type):
+    def _evaluate_efficiency(self, text, similarity, assignment_type, keyword_fraction):
         """Evaluate efficiency considerations"""
-        # Check for efficiency-related keywords
-        efficiency_keywords = ['complexity', 'time', 'space', 'optimize', 'efficient', 'algorithm']
-        found_keywords = sum(1 for kw in efficiency_keywords if kw in text)
-        
-        keyword_score = (found_keywords / len(efficiency_keywords)) * 40
+        # Share of efficiency-related keywords present
+        keyword_score = keyword_fraction * 40
         similarity_score = similarity * 60
         
         score = int(keyword_score + similarity_score)
@@ -216,13 +551,10 @@ class IntelligentEvaluator:
         
         return score, feedback
     
-    def _evaluate_symbols(self, text, similarity, assignment_type):
+    def _evaluate_symbols(self, text, similarity, assignment_type, keyword_fraction):
         """Evaluate use of flowchart symbols"""
-        # Check for flowchart-related terms
-        symbol_keywords = ['start', 'end', 'decision', 'process', 'input', 'output', 'connector']
-        found_keywords = sum(1 for kw in symbol_keywords if kw in text)
-        
-        keyword_score = (found_keywords / len(symbol_keywords)) * 50
+        # Share of flowchart-related terms present
+        keyword_score = keyword_fraction * 50
         similarity_score = similarity * 50
         
         score = int(keyword_score + similarity_score)
@@ -0,0 +1,367 @@
+"""
+Headless bulk grading of a folder of images or a CSV/JSONL manifest
+
+    python grade.py scans/ --type flowchart --output results.jsonl
+    python grade.py manifest.csv --output results.csv --workers 8
+
+Manifest rows need student_id, assignment_type and either text or image_path
+(relative paths are resolved against the manifest's folder); student_name and
+rubric_id are optional. For a folder, every image is graded with the student ID
+taken from the file name, and the assignment type from --type or from a parent
+folder named after the type. Items without a rubric_id use --rubric-id, or the
+default rubric of their type.
+
+Results are appended to the output file as each batch finishes. Rerunning the
+same command skips every item already recorded there, so an interrupted run
+picks up where it stopped; items that failed are retried.
+
+The database is the source of truth for what has been graded: each saved
+submission keeps its item key, and an item found there is never graded again.
+If a run stopped after saving a batch but before recording it, the next run
+writes those results to the output file from the database.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+ASSIGNMENT_TYPES = ('algorithm', 'flowchart', 'pseudocode')
+CSV_FIELDS = ['key', 'student_id', 'student_name', 'assignment_type', 'image_path',
+              'submission_id', 'overall_score', 'feedback', 'error']
+
+# OCR processor of each pool process, built by _init_ocr
+_ocr_processor = None
+
+def _init_ocr():
+    global _ocr_processor
+    from ocr_processor import OCRProcessor
+    from ocr_cache import OCRCache
+    # Parallelism comes from the process pool, so each process runs one search at a time
+    _ocr_processor = OCRProcessor(max_workers=1, cache=OCRCache(), scale_mode='normalized')
+
+def _extract_text(item):
+    """Answer text of one item, running OCR in the pool process when needed"""
+    if item.get('text'):
+        return item['text'], None
+    try:
+        result = _ocr_processor.extract_with_confidence(item['image_path'], search_mode='adaptive')
+    except Exception as e:
+        return None, str(e)
+    if not result['text'].strip():
+        return None, "No text could be extracted from the image"
+    return result['text'], None
+
+def item_key(item):
+    """Stable identity of an item, used to skip it when resuming"""
+    source = item.get('image_path') or hashlib.sha1(item['text'].encode('utf-8')).hexdigest()[:16]
+    key = f"{item['student_id']}|{item['assignment_type']}|{source}"
+    return f"{key}|rubric {item['rubric_id']}" if item.get('rubric_id') else key
+
+def load_folder(folder, assignment_type=None, rubric_id=None):
+    """Items for every image under folder"""
+    items = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        folder_type = os.path.basename(root).lower()
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            item_type = folder_type if folder_type in ASSIGNMENT_TYPES else assignment_type
+            if not item_type:
+                raise ValueError(f"No assignment type for {os.path.join(root, name)}; pass --type")
+            student_id = os.path.splitext(name)[0]
+            items.append({
+                'student_id': student_id,
+                'student_name': student_id,
+                'assignment_type': item_type,
+                'image_path': os.path.join(root, name),
+                'text': None,
+                'rubric_id': rubric_id
+            })
+    return items
+
+def _field(row, name, default=''):
+    """Manifest value as stripped text; JSONL values can be numbers, e.g. "student_id": 123"""
+    value = row.get(name)
+    return default if value is None or value == '' else str(value).strip()
+
+def load_manifest(path, assignment_type=None, rubric_id=None):
+    """Items listed in a CSV or JSONL manifest"""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    
+    base_dir = os.path.dirname(os.path.abspath(path))
+    items = []
+    for line, row in enumerate(rows, start=1):
+        student_id = _field(row, 'student_id')
+        item_type = _field(row, 'assignment_type', assignment_type or '')
+        text = None if row.get('text') in (None, '') else str(row['text'])
+        image_path = _field(row, 'image_path') or None
+        row_rubric_id = row.get('rubric_id') or rubric_id
+        if not student_id or not item_type or not (text or image_path):
+            raise ValueError(f"{path}, row {line}: student_id, assignment_type and text or image_path are required")
+        if image_path and not os.path.isabs(image_path):
+            image_path = os.path.join(base_dir, image_path)
+        items.append({
+            'student_id': student_id,
+            'student_name': _field(row, 'student_name', student_id),
+            'assignment_type': item_type,
+            'image_path': image_path,
+            'text': text,
+            'rubric_id': int(row_rubric_id) if row_rubric_id else None
+        })
+    return items
+
+class ResultWriter:
+    """Appends result records to a JSONL or CSV file and remembers finished items"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.is_csv = path.lower().endswith('.csv')
+        self.done = self._read_done()
+        self._file = open(path, 'a', encoding='utf-8', newline='')
+        if self.is_csv:
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if self._file.tell() == 0:
+                self._csv.writeheader()
+    
+    def _read_done(self):
+        """Keys of items graded by a previous run"""
+        if not os.path.exists(self.path):
+            return set()
+        
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            records, length = self._parse(data)
+            if length < len(data):
+                # Drop a record cut off by an interruption before appending to the file
+                f.truncate(length)
+        return {record['key'] for record in records if not record.get('error')}
+    
+    def _parse(self, data):
+        """
+        Complete records at the start of data, and the number of bytes they take
+        
+        Parsing stops at the first record that is cut off or unreadable. A CSV
+        record can span lines (feedback is multi-line), so a CSV tail is only
+        complete if it parses with every quoted field closed.
+        """
+        # UTF-8 never uses the newline byte inside a character, so splitting bytes is safe
+        lines = re.findall(rb'[^\n]*\n|[^\n]+', data)
+        ends = []
+        
+        def decoded_lines():
+            end = 0
+            for line in lines:
+                end += len(line)
+                ends.append(end)
+                yield line.decode('utf-8')
+        
+        records = []
+        length = 0
+        try:
+            if self.is_csv:
+                reader = csv.reader(decoded_lines(), strict=True)
+                header = next(reader, None)
+                if header is None or not lines[len(ends) - 1].endswith(b'\n'):
+                    return records, length
+                length = ends[-1]
+                for row in reader:
+                    if len(row) != len(header) or not lines[len(ends) - 1].endswith(b'\n'):
+                        break
+                    records.append(dict(zip(header, row)))
+                    length = ends[-1]
+            else:
+                for line in decoded_lines():
+                    if not line.endswith('\n'):
+                        break
+                    if line.strip():
+                        records.append(json.loads(line))
+                    length = ends[-1]
+        except (csv.Error, ValueError):
+            pass  # ValueError covers bad JSON and a character cut in half
+        return records, length
+    
+    def write(self, record):
+        if self.is_csv:
+            self._csv.writerow(record)
+        else:
+            self._file.write(json.dumps(record) + '\n')
+    
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def close(self):
+        self._file.close()
+
+def result_record(item, submission_id=None, result=None, error=None):
+    """Output file record of one item"""
+    record = {
+        'key': item['key'],
+        'student_id': item['student_id'],
+        'student_name': item['student_name'],
+        'assignment_type': item['assignment_type'],
+        'image_path': item['image_path'],
+        'submission_id': submission_id,
+        'error': error
+    }
+    if result is not None:
+        record.update(result)
+    return record
+
+def record_saved(db, writer, items):
+    """
+    Record items the database already holds, e.g. saved by an interrupted run
+    
+    Returns:
+        The items still to be graded
+    """
+    saved = db.get_graded_submissions(item['key'] for item in items)
+    for item in items:
+        if item['key'] in saved:
+            _, evaluation = db.get_evaluation(saved[item['key']])
+            writer.write(result_record(item, saved[item['key']], evaluation.to_result()))
+    writer.flush()
+    return [item for item in items if item['key'] not in saved]
+
+class BulkGrader:
+    """Evaluates items in per-rubric batches, saving each batch and then recording it"""
+    
+    def __init__(self, db, rubric_manager, evaluator, writer, batch_size=64):
+        self.db = db
+        self.rubric_manager = rubric_manager
+        self.evaluator = evaluator
+        self.writer = writer
+        self.batch_size = batch_size
+        self.prepared = set()
+        self.pending = {}
+        self.graded = 0
+        self.failed = 0
+    
+    def add(self, item, text, error=None):
+        """Queue an item for evaluation, or record why it could not be graded"""
+        rubric = self._rubric(item)
+        if error is None and rubric is None:
+            error = f"Rubric not found for assignment type {item['assignment_type']}"
+        if error is not None:
+            self._record(item, error=error)
+            self.writer.flush()
+            return
+        
+        _, batch = self.pending.setdefault(rubric['id'], (rubric, []))
+        batch.append((item, text))
+        if len(batch) >= self.batch_size:
+            self.flush(rubric['id'])
+    
+    def flush(self, rubric_id=None):
+        """Evaluate and save the pending items of one rubric, or of all rubrics"""
+        rubric_ids = [rubric_id] if rubric_id else list(self.pending)
+        for rubric_id in rubric_ids:
+            rubric, batch = self.pending.pop(rubric_id, (None, []))
+            if not batch:
+                continue
+            results = self.evaluator.evaluate_batch([text for _, text in batch], rubric)
+            
+            # The whole batch is saved in one transaction
+            submission_ids = self.db.save_evaluations([
+                (
+                    {
+                        'student_id': item['student_id'],
+                        'student_name': item['student_name'],
+                        'assignment_type': item['assignment_type'],
+                        'image_path': item['image_path'],
+                        'extracted_text': text,
+                        'original_text': item['text'] or text,
+                        'grade_key': item['key']
+                    },
+                    rubric_id,
+                    result
+                )
+                for (item, text), result in zip(batch, results)
+            ])
+            for (item, _), submission_id, result in zip(batch, submission_ids, results):
+                self._record(item, submission_id=submission_id, result=result)
+            self.writer.flush()
+    
+    def _rubric(self, item):
+        """Rubric named by the item, or the default rubric of its type"""
+        if item.get('rubric_id'):
+            rubric = self.rubric_manager.get_rubric_by_id(item['rubric_id'])
+        else:
+            rubric = self.rubric_manager.get_rubric(item['assignment_type'])
+        if rubric and rubric['id'] not in self.prepared:
+            self.evaluator.prepare_rubrics([rubric])
+            self.prepared.add(rubric['id'])
+        return rubric
+    
+    def _record(self, item, submission_id=None, result=None, error=None):
+        if result is not None:
+            self.graded += 1
+        else:
+            self.failed += 1
+        self.writer.write(result_record(item, submission_id, result, error))
+
+def main():
+    from evaluator import BACKENDS, IntelligentEvaluator
+    
+    parser = argparse.ArgumentParser(description="Grade a folder of images or a CSV/JSONL manifest without the web app")
+    parser.add_argument('input', help="folder of images, or a .csv/.jsonl manifest")
+    parser.add_argument('--output', '-o', required=True, help="results file (.jsonl or .csv); appended to when resuming")
+    parser.add_argument('--type', choices=ASSIGNMENT_TYPES, help="assignment type for items that don't give one")
+    parser.add_argument('--rubric-id', type=int, help="rubric for items that don't give one (default: the type's default rubric)")
+    parser.add_argument('--workers', type=int, default=None, help="OCR processes (default: one per CPU)")
+    parser.add_argument('--backend', choices=BACKENDS, default=None,
+                        help="model inference backend (default: EVALUATOR_BACKEND or torch)")
+    parser.add_argument('--batch-size', type=int, default=64, help="answers evaluated together")
+    args = parser.parse_args()
+    
+    if os.path.isdir(args.input):
+        items = load_folder(args.input, args.type, args.rubric_id)
+    else:
+        items = load_manifest(args.input, args.type, args.rubric_id)
+    for item in items:
+        item['key'] = item_key(item)
+    
+    from database import Database
+    db = Database()
+    writer = ResultWriter(args.output)
+    todo = [item for item in items if item['key'] not in writer.done]
+    todo = record_saved(db, writer, todo)
+    print(f"{len(items)} items, {len(items) - len(todo)} already graded, {len(todo)} to grade")
+    if not todo:
+        writer.close()
+        return
+    
+    # Start the OCR processes before loading the model into this one
+    pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_ocr)
+    try:
+        texts = pool.map(_extract_text, todo, chunksize=1)
+        
+        from rubric_manager import RubricManager
+        grader = BulkGrader(db, RubricManager(db), IntelligentEvaluator(backend=args.backend), writer, args.batch_size)
+        for done, (item, (text, error)) in enumerate(zip(todo, texts), start=1):
+            grader.add(item, text, error)
+            if done % args.batch_size == 0:
+                print(f"Processed {done}/{len(todo)}")
+        grader.flush()
+    finally:
+        # On interruption, drop queued OCR work; finished batches are already recorded
+        pool.shutdown(cancel_futures=True)
+        writer.close()
+    
+    print(f"✅ Graded {grader.graded} items, {grader.failed} failed. Results in {args.output}")
+    if grader.failed:
+        print("Rerun the same command to retry the failed items.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
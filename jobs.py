@@ -0,0 +1,279 @@
+"""
+Evaluation job queue persisted in the database, and the workers that drain it
+
+Submissions are enqueued by the app and evaluated by a pool of worker threads,
+either inside the app process or in separate worker processes:
+
+    python jobs.py --workers 4
+"""
+import argparse
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from database import Job
+from metrics import registry as metrics, serve as serve_metrics, span
+
+class JobQueue:
+    """Evaluation jobs stored in the jobs table, shared by every process using the database"""
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def enqueue(self, student_id, student_name, assignment_type, text=None, image_path=None, rubric_id=None):
+        """
+        Queue a submission for evaluation
+        
+        Args:
+            text: Answer text; when omitted, the worker runs OCR on image_path
+            rubric_id: Rubric to grade against; defaults to the type's default rubric
+        
+        Returns:
+            ID of the new job
+        """
+        if not (text or '').strip() and not image_path:
+            raise ValueError("A job needs either answer text or an image")
+        
+        with self.db.session_scope() as session:
+            job = Job(
+                status='queued',
+                student_id=student_id,
+                student_name=student_name,
+                assignment_type=assignment_type,
+                rubric_id=rubric_id,
+                text=text,
+                image_path=image_path
+            )
+            session.add(job)
+            session.flush()
+            return job.id
+    
+    def get(self, job_id):
+        """Current state of a job, or None"""
+        with self.db.session_scope() as session:
+            return session.get(Job, job_id)
+    
+    def claim(self, worker):
+        """
+        Atomically take the oldest queued job
+        
+        The conditional UPDATE only succeeds for one worker, so several
+        processes can poll the same table without running a job twice.
+        
+        Returns:
+            The claimed Job, or None when the queue is empty
+        """
+        while True:
+            with self.db.session_scope() as session:
+                job_id = (
+                    session.query(Job.id)
+                    .filter(Job.status == 'queued')
+                    .order_by(Job.id)
+                    .limit(1)
+                    .scalar()
+                )
+                if job_id is None:
+                    return None
+                
+                claimed = session.execute(
+                    update(Job)
+                    .where(Job.id == job_id, Job.status == 'queued')
+                    .values(
+                        status='running',
+                        worker=worker,
+                        started_at=datetime.utcnow(),
+                        attempts=Job.attempts + 1
+                    )
+                ).rowcount
+                if claimed:
+                    return session.get(Job, job_id, populate_existing=True)
+            # Another worker took it first; try the next one
+    
+    def complete(self, job_id, submission_id):
+        """Mark a job done with the submission holding its evaluation"""
+        self._finish(job_id, status='done', submission_id=submission_id, error=None)
+    
+    def fail(self, job_id, error):
+        """Mark a job failed"""
+        self._finish(job_id, status='failed', error=str(error))
+    
+    def requeue_stale(self, timeout=600, max_attempts=3):
+        """
+        Return jobs left running by a crashed worker to the queue
+        
+        Returns:
+            Number of jobs requeued
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=timeout)
+        with self.db.session_scope() as session:
+            stale = (Job.status == 'running', Job.started_at < cutoff)
+            session.execute(
+                update(Job)
+                .where(*stale, Job.attempts >= max_attempts)
+                .values(status='failed', error='Worker stopped before finishing', finished_at=datetime.utcnow())
+            )
+            return session.execute(
+                update(Job).where(*stale).values(status='queued', worker=None)
+            ).rowcount
+    
+    def _finish(self, job_id, **values):
+        with self.db.session_scope() as session:
+            session.execute(
+                update(Job)
+                .where(Job.id == job_id)
+                .values(finished_at=datetime.utcnow(), **values)
+            )
+
+class WorkerPool:
+    """Threads that claim jobs, run OCR and evaluation, and save the results"""
+    
+    def __init__(self, queue, rubric_manager, get_evaluator, get_ocr_processor,
+                 num_workers=None, poll_interval=1.0, requeue_interval=60):
+        """
+        Args:
+            get_evaluator: Callable returning the evaluator, loaded on first job
+            get_ocr_processor: Callable returning the OCR processor
+            num_workers: Worker threads; defaults to one per CPU
+            requeue_interval: Minimum seconds between idle checks for jobs
+                left running by a crashed worker
+        """
+        self.queue = queue
+        self.rubric_manager = rubric_manager
+        self.get_evaluator = get_evaluator
+        self.get_ocr_processor = get_ocr_processor
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.requeue_interval = requeue_interval
+        self._last_requeue = None
+        self._requeue_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._name = f"{socket.gethostname()}:{os.getpid()}"
+    
+    def start(self):
+        """Start the worker threads"""
+        if self._threads:
+            return self
+        self._requeue_stale(force=True)
+        
+        self._stop.clear()
+        for i in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._run, args=(f"{self._name}:{i}",),
+                name=f"evaluation-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        return self
+    
+    def stop(self, timeout=None):
+        """Ask the workers to exit after their current job and wait for them"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+    
+    def _requeue_stale(self, force=False):
+        """Requeue jobs of crashed workers, at most once per requeue_interval across the pool"""
+        with self._requeue_lock:
+            now = time.monotonic()
+            if not force and self._last_requeue is not None and now - self._last_requeue < self.requeue_interval:
+                return
+            self._last_requeue = now
+        try:
+            requeued = self.queue.requeue_stale()
+        except Exception as e:
+            print(f"Warning: could not requeue unfinished jobs: {e}")
+            return
+        if requeued:
+            print(f"Requeued {requeued} unfinished jobs")
+    
+    def _run(self, worker):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(worker)
+            except Exception as e:
+                print(f"Warning: could not claim a job: {e}")
+                job = None
+            if job is None:
+                # Idle: also pick up jobs left running by workers that died since start
+                self._requeue_stale()
+                self._stop.wait(self.poll_interval)
+                continue
+            
+            if job.created_at and job.started_at:
+                metrics.observe('job.queue_wait', (job.started_at - job.created_at).total_seconds())
+            try:
+                with span('job.process'):
+                    submission_id = self.process(job)
+            except Exception as e:
+                self._finish(self.queue.fail, job.id, e)
+            else:
+                self._finish(self.queue.complete, job.id, submission_id)
+    
+    def _finish(self, record, job_id, outcome):
+        """Record a job's outcome; on a database error the job stays running until requeued"""
+        try:
+            record(job_id, outcome)
+        except Exception as e:
+            print(f"Warning: could not record the outcome of job {job_id}: {e}")
+    
+    def process(self, job):
+        """Evaluate one job and save it; returns the new submission ID"""
+        if job.rubric_id:
+            rubric = self.rubric_manager.get_rubric_by_id(job.rubric_id)
+        else:
+            rubric = self.rubric_manager.get_rubric(job.assignment_type)
+        if not rubric:
+            raise ValueError(f"Rubric not found for assignment type {job.assignment_type}")
+        
+        text = job.text
+        if not (text or '').strip():
+            ocr_result = self.get_ocr_processor().extract_with_confidence(
+                job.image_path, search_mode='adaptive'
+            )
+            text = ocr_result['text']
+            if not text.strip():
+                raise ValueError("No text could be extracted from the image")
+        
+        evaluation_result = self.get_evaluator().evaluate(text, rubric)
+        return self.queue.db.save_evaluation(
+            {
+                'student_id': job.student_id,
+                'student_name': job.student_name,
+                'assignment_type': job.assignment_type,
+                'image_path': job.image_path,
+                'extracted_text': text,
+                'original_text': text
+            },
+            rubric['id'],
+            evaluation_result
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Run evaluation workers against the shared database")
+    parser.add_argument('--workers', type=int, default=None, help="worker threads (default: one per CPU)")
+    parser.add_argument('--metrics-port', type=int, default=None, help="serve Prometheus metrics on this port")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds between polls of an empty queue")
+    args = parser.parse_args()
+    
+    from resources import get_evaluator, get_ocr_processor, get_queue, get_rubric_manager
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+        print(f"Serving metrics on port {args.metrics_port}")
+    pool = WorkerPool(
+        get_queue(), get_rubric_manager(), get_evaluator, get_ocr_processor,
+        num_workers=args.workers, poll_interval=args.poll_interval
+    ).start()
+    print(f"Started {pool.num_workers} evaluation workers; press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping workers after their current jobs...")
+        pool.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Word-boundary keyword matching, compiled once per keyword set
+"""
+import re
+from functools import lru_cache
+
+_WORD = re.compile(r'\w+')
+
+class KeywordMatcher:
+    """
+    Finds which of a fixed set of keywords occur in a text, without a scan per keyword
+    
+    Keywords match whole words only, case-insensitively: 'if' matches
+    "if x > 0" but not "modify". Multi-word keywords match as phrases.
+    """
+    
+    def __init__(self, keywords):
+        # Lowercased and de-duplicated, keeping the declared order
+        self.keywords = tuple(dict.fromkeys(k.strip().lower() for k in keywords if k.strip()))
+        
+        # Single words are looked up in the text's word set; phrases and
+        # keywords with punctuation go through one compiled alternation
+        self._words = frozenset(k for k in self.keywords if _WORD.fullmatch(k))
+        phrases = sorted((k for k in self.keywords if k not in self._words), key=len, reverse=True)
+        alternation = '|'.join(re.escape(k) for k in phrases)
+        self._pattern = re.compile(rf"(?<!\w)(?:{alternation})(?!\w)", re.IGNORECASE) if phrases else None
+    
+    def find(self, text):
+        """Set of keywords present in text"""
+        if not text:
+            return set()
+        found = set(_WORD.findall(text.lower())) & self._words
+        if self._pattern is not None:
+            found.update(match.group(0).lower() for match in self._pattern.finditer(text))
+        return found
+    
+    def fraction(self, text):
+        """Share of the keywords present in text, from 0 to 1"""
+        if not self.keywords:
+            return 0.0
+        return len(self.find(text)) / len(self.keywords)
+    
+    def find_batch(self, texts):
+        """find() for every text, in order"""
+        return [self.find(text) for text in texts]
+    
+    def fraction_batch(self, texts):
+        """fraction() for every text, in order"""
+        return [self.fraction(text) for text in texts]
+
+@lru_cache(maxsize=256)
+def _compile(keywords):
+    return KeywordMatcher(keywords)
+
+def get_matcher(keywords):
+    """Shared compiled matcher for a keyword list (compiled on first use)"""
+    return _compile(tuple(keywords))
@@ -0,0 +1,162 @@
+"""
+Lightweight per-stage latency metrics, aggregated in-process
+
+Wrap a stage in `with span('ocr.tesseract'):` or decorate it with
+`@timed('db.commit')`. Durations go into fixed-bucket histograms that can be
+read on the app's Performance page, written as Prometheus text, or served
+over HTTP. Set EVALUATOR_METRICS=0 to turn recording off.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENV = 'EVALUATOR_METRICS'
+METRICS_PORT_ENV = 'EVALUATOR_METRICS_PORT'
+
+# Histogram bucket upper bounds in seconds (Prometheus 'le' labels)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Counts of observed durations per bucket, with their sum"""
+    
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, seconds):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += seconds
+        self.count += 1
+    
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """Latency histograms by stage name"""
+    
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, stage, seconds):
+        """Record one duration for a stage"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+    
+    def summary(self):
+        """Per-stage count, total, mean and estimated p50/p95/p99 in seconds"""
+        with self._lock:
+            return [
+                {
+                    'stage': stage,
+                    'count': h.count,
+                    'total_s': h.sum,
+                    'mean_s': h.sum / h.count,
+                    'p50_s': h.quantile(0.50),
+                    'p95_s': h.quantile(0.95),
+                    'p99_s': h.quantile(0.99)
+                }
+                for stage, h in sorted(self._histograms.items())
+            ]
+    
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+    
+    def to_prometheus(self):
+        """Histograms in the Prometheus text exposition format"""
+        lines = [
+            '# HELP evaluator_stage_seconds Latency of submission pipeline stages',
+            '# TYPE evaluator_stage_seconds histogram'
+        ]
+        with self._lock:
+            for stage, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append(f'evaluator_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'evaluator_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'evaluator_stage_seconds_count{{stage="{stage}"}} {h.count}')
+        return '\n'.join(lines) + '\n'
+    
+    def write_prometheus(self, path):
+        """Write the Prometheus text to a file, e.g. for node_exporter's textfile collector"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+registry = MetricsRegistry(enabled=os.environ.get(METRICS_ENV, '1') != '0')
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one observation of stage"""
+    if not registry.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(stage, time.perf_counter() - start)
+
+def timed(stage):
+    """Decorator form of span"""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('', '/metrics'):
+            self.send_error(404)
+            return
+        body = registry.to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line each
+
+def serve(port, host='0.0.0.0'):
+    """Serve /metrics in Prometheus text format from a background thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,129 @@
+"""
+Content-addressed on-disk cache for preprocessed images and OCR results
+"""
+import hashlib
+import json
+import os
+import threading
+import cv2
+
+class OCRCache:
+    """
+    Cache keyed by the image's content hash plus the processing parameters.
+    
+    Preprocessed images are stored as PNG files and OCR results as JSON.
+    When the cache grows beyond max_bytes, least recently used entries are
+    evicted down to evict_to of it (file modification time is refreshed on
+    every hit).
+    
+    The folder size is tracked as a running total, so writes don't scan the
+    folder. It is rescanned when the total passes max_bytes, and after every
+    rescan_bytes written, which picks up entries written by other processes
+    sharing the folder (e.g. grade.py's OCR pool).
+    """
+    
+    def __init__(self, cache_dir='ocr_cache', max_bytes=512 * 1024 * 1024, evict_to=0.9, rescan_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.evict_to = evict_to
+        self.rescan_bytes = rescan_bytes or max(1, max_bytes // 16)
+        self._lock = threading.Lock()
+        self._total = None  # Folder size at the last scan plus bytes written since
+        self._written = 0  # Bytes written since the last scan
+        os.makedirs(self.cache_dir, exist_ok=True)
+    
+    def make_key(self, image_digest, kind, **params):
+        """Cache key for one kind of artifact computed with the given parameters"""
+        payload = json.dumps([image_digest, kind, params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get_image(self, key):
+        """Return a cached preprocessed image, or None"""
+        path = self._path(key, '.png')
+        if not os.path.exists(path):
+            return None
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is not None:
+            self._touch(path)
+        return img
+    
+    def put_image(self, key, img):
+        """Store a preprocessed image"""
+        ok, encoded = cv2.imencode('.png', img)
+        if ok:
+            self._write(self._path(key, '.png'), encoded.tobytes())
+    
+    def get_result(self, key):
+        """Return a cached OCR result dictionary, or None"""
+        path = self._path(key, '.json')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return result
+    
+    def put_result(self, key, result):
+        """Store an OCR result dictionary"""
+        self._write(self._path(key, '.json'), json.dumps(result).encode('utf-8'))
+    
+    def _path(self, key, suffix):
+        return os.path.join(self.cache_dir, f"{key}{suffix}")
+    
+    def _touch(self, path):
+        """Mark an entry as recently used"""
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+    
+    def _write(self, path, data):
+        """Write atomically, then enforce the size bound"""
+        try:
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return  # Caching is best effort
+        
+        with self._lock:
+            if self._total is not None:
+                self._total += len(data)
+                self._written += len(data)
+                if self._total <= self.max_bytes and self._written < self.rescan_bytes:
+                    return
+            self._evict()
+    
+    def _evict(self):
+        """
+        Rescan the folder and, if it is over max_bytes, remove least recently
+        used entries until it fits in evict_to of it; called with the lock held
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        
+        if total > self.max_bytes:
+            # Leave headroom so the next writes don't each trigger another eviction
+            target = self.max_bytes * self.evict_to
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= target:
+                    break
+        
+        self._total = total
+        self._written = 0
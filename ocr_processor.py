@@ -7,9 +7,177 @@ import cv2
 import numpy as np
 import re
 import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span, timed
+
+# Tesseract page segmentation modes tried for every preprocessed image
+PSM_MODES = [
+    (6, r'--oem 3 --psm 6'),  # Uniform block of text
+    (11, r'--oem 3 --psm 11'),  # Sparse text
+    (12, r'--oem 3 --psm 12'),  # Sparse text with OSD
+    (3, r'--oem 3 --psm 3'),  # Fully automatic page segmentation
+]
+
+# Preprocessing methods tried by extract_with_confidence
+PREPROCESS_METHODS = ['enhanced', 'aggressive', 'standard']
+
+# Adaptive search order: cheapest and most likely candidates first. The
+# expensive 3x 'aggressive' upscale is only tried for low-confidence images.
+ADAPTIVE_CANDIDATES = [
+    ('enhanced', 6), ('enhanced', 3), ('standard', 6), ('enhanced', 11),
+    ('standard', 3), ('enhanced', 12), ('standard', 11), ('standard', 12),
+]
+ADAPTIVE_FALLBACK_CANDIDATES = [
+    ('aggressive', 6), ('aggressive', 3), ('aggressive', 11), ('aggressive', 12),
+]
+
+class PreprocessingPipeline:
+    """
+    Decodes an image once and shares intermediate stages across preprocessing methods
+    
+    The source may be a file path, encoded image bytes, or a decoded array
+    (grayscale or BGR). Grayscale and upscaled images are computed on first
+    use and reused by every method built from the same pipeline.
+    """
+    
+    def __init__(self, source):
+        self.source = source
+        self._stages = {}
+        self._lock = threading.RLock()
+    
+    def _stage(self, name, build):
+        """Compute a shared stage once; safe to call from several workers"""
+        stage = self._stages.get(name)
+        if stage is None:
+            with self._lock:
+                stage = self._stages.get(name)
+                if stage is None:
+                    stage = build()
+                    self._stages[name] = stage
+        return stage
+    
+    def _read_bytes(self):
+        if isinstance(self.source, str):
+            with open(self.source, 'rb') as f:
+                return f.read()
+        return bytes(self.source)
+    
+    def raw(self):
+        """Encoded image bytes (None for array sources)"""
+        if isinstance(self.source, np.ndarray):
+            return None
+        return self._stage('raw', self._read_bytes)
+    
+    def digest(self):
+        """SHA-256 identifying the image content"""
+        def build():
+            if isinstance(self.source, np.ndarray):
+                content = str(self.source.shape).encode('utf-8') + np.ascontiguousarray(self.source).tobytes()
+            else:
+                content = self.raw()
+            return hashlib.sha256(content).hexdigest()
+        return self._stage('digest', build)
+    
+    def image(self):
+        """Decoded image"""
+        def build():
+            if isinstance(self.source, np.ndarray):
+                return self.source
+            with span('ocr.decode'):
+                img = cv2.imdecode(np.frombuffer(self.raw(), np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                label = self.source if isinstance(self.source, str) else 'image bytes'
+                raise ValueError(f"Could not read image from {label}")
+            return img
+        return self._stage('image', build)
+    
+    def gray(self):
+        """Grayscale image"""
+        def build():
+            img = self.image()
+            if len(img.shape) == 2:
+                return img
+            if img.shape[2] == 4:
+                return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+            return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return self._stage('gray', build)
+    
+    def upscaled(self, factor):
+        """Grayscale image upscaled by an integer factor"""
+        def build():
+            gray = self.gray()
+            height, width = gray.shape
+            return cv2.resize(gray, (width * factor, height * factor), interpolation=cv2.INTER_CUBIC)
+        return self._stage(('upscaled', factor), build)
+    
+    def scaled(self, factor):
+        """Grayscale image resized by an arbitrary factor"""
+        factor = round(factor, 3)
+        if factor == 1:
+            return self.gray()
+        if factor == int(factor) and factor > 1:
+            return self.upscaled(int(factor))
+        
+        def build():
+            gray = self.gray()
+            height, width = gray.shape
+            size = (max(1, int(round(width * factor))), max(1, int(round(height * factor))))
+            # INTER_AREA avoids aliasing when shrinking large photos
+            interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_CUBIC
+            return cv2.resize(gray, size, interpolation=interpolation)
+        return self._stage(('scaled', factor), build)
+    
+    def text_height(self):
+        """Estimated height in pixels of a line of text (median character height), or None"""
+        def build():
+            gray = self.gray()
+            height, width = gray.shape
+            
+            # Estimate on a reduced copy; heights scale back linearly
+            probe_scale = min(1.0, 1024.0 / max(height, width))
+            probe = gray
+            if probe_scale < 1:
+                probe_size = (max(1, int(width * probe_scale)), max(1, int(height * probe_scale)))
+                probe = cv2.resize(gray, probe_size, interpolation=cv2.INTER_AREA)
+            
+            # Dark glyphs on light paper become foreground components
+            _, binary = cv2.threshold(probe, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+            heights = stats[1:, cv2.CC_STAT_HEIGHT]
+            widths = stats[1:, cv2.CC_STAT_WIDTH]
+            areas = stats[1:, cv2.CC_STAT_AREA]
+            
+            # Keep character-sized blobs: not specks, not lines or boxes
+            plausible = (
+                (heights >= 3) & (areas >= 6) &
+                (heights <= probe.shape[0] * 0.2) &
+                (widths <= heights * 4)
+            )
+            if not plausible.any():
+                return -1.0
+            return float(np.median(heights[plausible])) / probe_scale
+        
+        estimate = self._stage('text_height', build)
+        return estimate if estimate > 0 else None
+    
+    def normalization_scale(self, target_text_height, max_pixels, min_scale=0.25, max_scale=4.0):
+        """Scale that brings text to the target height without exceeding max_pixels"""
+        height, width = self.gray().shape
+        text_height = self.text_height()
+        
+        scale = 1.0
+        if text_height:
+            scale = min(max_scale, max(min_scale, target_text_height / text_height))
+        
+        # Bound per-image work and memory regardless of camera resolution
+        return min(scale, (max_pixels / float(height * width)) ** 0.5)
 
 class OCRProcessor:
-    def __init__(self):
+    def __init__(self, max_workers=None, search_mode='grid', min_confidence=85,
+                 min_words=5, fallback_confidence=60, cache=None, scale_mode='fixed',
+                 target_text_height=30, max_megapixels=8.0):
         # Configure Tesseract path (Windows default)
         # For Linux/Mac, this might not be needed
         try:
@@ -19,18 +187,56 @@ class OCRProcessor:
                 pytesseract.pytesseract.tesseract_cmd = tesseract_path
         except:
             pass  # Use system default if not found
+        
+        # Worker pool for the OCR candidate grid (Tesseract runs as a
+        # subprocess and OpenCV releases the GIL, so threads scale)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        
+        # Candidate search: 'grid' tries every method x PSM combination,
+        # 'adaptive' stops at the first result that passes the thresholds
+        self.search_mode = search_mode
+        self.min_confidence = min_confidence
+        self.min_words = min_words
+        self.fallback_confidence = fallback_confidence
+        
+        # Optional OCRCache for preprocessed images and OCR results
+        self.cache = cache
+        
+        # Image scaling before the expensive filters: 'fixed' upscales 2x/3x
+        # as before, 'normalized' resizes so text reaches target_text_height
+        # pixels and the image stays under max_megapixels
+        self.scale_mode = scale_mode
+        self.target_text_height = target_text_height
+        self.max_megapixels = max_megapixels
     
-    def enhance_image_quality(self, img):
-        """Enhance image quality for blurry images"""
-        # Convert to grayscale if needed
-        if len(img.shape) == 3:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = img.copy()
+    def _map(self, func, *iterables):
+        """Run func over the inputs on the shared worker pool, preserving order"""
+        if self.max_workers <= 1:
+            return list(map(func, *iterables))
         
-        # Upscale image for better OCR (2x upscaling)
-        height, width = gray.shape
-        upscaled = cv2.resize(gray, (width * 2, height * 2), interpolation=cv2.INTER_CUBIC)
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='ocr'
+                    )
+        return list(self._executor.map(func, *iterables))
+    
+    def enhance_image_quality(self, img, upscaled=None):
+        """Enhance image quality for blurry images (pass upscaled to reuse a 2x resize)"""
+        if upscaled is None:
+            # Convert to grayscale if needed
+            if len(img.shape) == 3:
+                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            else:
+                gray = img.copy()
+            
+            # Upscale image for better OCR (2x upscaling)
+            height, width = gray.shape
+            upscaled = cv2.resize(gray, (width * 2, height * 2), interpolation=cv2.INTER_CUBIC)
         
         # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization) for better contrast
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
@@ -55,26 +261,78 @@ class OCRProcessor:
             return sharpened
         return unsharp
     
-    def preprocess_image(self, image_path, method='enhanced'):
-        """Preprocess image for better OCR results with multiple strategies"""
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Could not read image from {image_path}")
+    def _cache_key(self, pipeline, kind, **params):
+        """Cache key for an artifact of this image, or None when caching is off"""
+        if self.cache is None:
+            return None
+        try:
+            digest = pipeline.digest()
+        except (OSError, TypeError):
+            return None
+        return self.cache.make_key(digest, kind, scaling=self._scaling_params(), **params)
+    
+    def _scaling_params(self):
+        """Parameters that change preprocessing output"""
+        if self.scale_mode == 'normalized':
+            return [self.scale_mode, self.target_text_height, self.max_megapixels]
+        return [self.scale_mode]
+    
+    def _scale_factors(self, pipeline):
+        """Resize factor applied to the grayscale image for each method"""
+        if self.scale_mode != 'normalized':
+            return {'enhanced': 2, 'aggressive': 3, 'standard': 1}
+        
+        max_pixels = self.max_megapixels * 1e6
+        base = pipeline.normalization_scale(self.target_text_height, max_pixels)
+        height, width = pipeline.gray().shape
+        pixel_cap = (max_pixels / float(height * width)) ** 0.5
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # 'aggressive' keeps its larger scale relative to 'enhanced' (3x vs 2x)
+        return {'enhanced': base, 'aggressive': min(base * 1.5, pixel_cap), 'standard': base}
+    
+    def _pipeline(self, image):
+        """Wrap a path, bytes or array in a pipeline (pipelines pass through)"""
+        if isinstance(image, PreprocessingPipeline):
+            return image
+        return PreprocessingPipeline(image)
+    
+    def preprocess_image(self, image, method='enhanced'):
+        """
+        Preprocess image for better OCR results with multiple strategies
+        
+        Args:
+            image: File path, encoded image bytes, decoded array or PreprocessingPipeline
+            method: 'enhanced', 'aggressive' or 'standard'
+        """
+        pipeline = self._pipeline(image)
+        key = self._cache_key(pipeline, 'preprocess', method=method)
+        if key is not None:
+            cached = self.cache.get_image(key)
+            if cached is not None:
+                return cached
+        
+        cleaned = self._preprocess(pipeline, method)
+        
+        if key is not None:
+            self.cache.put_image(key, cleaned)
+        return cleaned
+    
+    @timed('ocr.preprocess')
+    def _preprocess(self, pipeline, method):
+        """Build one preprocessing variant from the pipeline's shared stages"""
+        factors = self._scale_factors(pipeline)
         
         if method == 'enhanced':
             # Enhanced preprocessing for blurry images
-            # Step 1: Enhance image quality (upscale + contrast)
-            enhanced = self.enhance_image_quality(gray)
+            # Step 1: Enhance image quality (shared upscale + contrast)
+            enhanced = self.enhance_image_quality(pipeline.gray(), upscaled=pipeline.scaled(factors['enhanced']))
             
             # Step 2: Apply deblurring
             deblurred = self.deblur_image(enhanced)
             
             # Step 3: Apply denoising (reduced strength to preserve details)
-            denoised = cv2.fastNlMeansDenoising(deblurred, None, 5, 7, 21)
+            with span('ocr.denoise'):
+                denoised = cv2.fastNlMeansDenoising(deblurred, None, 5, 7, 21)
             
             # Step 4: Apply adaptive thresholding (better for varying lighting)
             thresh = cv2.adaptiveThreshold(
@@ -91,8 +349,7 @@ class OCRProcessor:
         elif method == 'aggressive':
             # Aggressive preprocessing for very blurry images
             # Upscale more
-            height, width = gray.shape
-            upscaled = cv2.resize(gray, (width * 3, height * 3), interpolation=cv2.INTER_CUBIC)
+            upscaled = pipeline.scaled(factors['aggressive'])
             
             # Strong sharpening
             sharpen_kernel = np.array([[-1, -1, -1, -1, -1],
@@ -119,7 +376,9 @@ class OCRProcessor:
             
         else:
             # Standard preprocessing (original method)
-            denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
+            upscaled = pipeline.scaled(factors['standard'])
+            with span('ocr.denoise'):
+                denoised = cv2.fastNlMeansDenoising(upscaled, None, 10, 7, 21)
             _, thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
             kernel = np.ones((1, 1), np.uint8)
             cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
@@ -133,28 +392,30 @@ class OCRProcessor:
                 processed_img = self.preprocess_image(image_path, method=method)
                 # Convert back to PIL Image
                 pil_img = Image.fromarray(processed_img)
-            else:
+            elif isinstance(image_path, str):
                 pil_img = Image.open(image_path)
+            else:
+                img = self._pipeline(image_path).image()
+                if len(img.shape) == 3:
+                    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                pil_img = Image.fromarray(img)
             
             # Try multiple PSM modes for better accuracy
-            psm_modes = [
-                (6, r'--oem 3 --psm 6'),  # Uniform block of text
-                (11, r'--oem 3 --psm 11'),  # Sparse text
-                (12, r'--oem 3 --psm 12'),  # Sparse text with OSD
-                (3, r'--oem 3 --psm 3'),  # Fully automatic page segmentation
-            ]
-            
             best_text = ""
             best_confidence = 0
+            default_text = None
             
-            for psm_num, config in psm_modes:
+            for psm_num, config in PSM_MODES:
                 try:
-                    text = pytesseract.image_to_string(pil_img, config=config)
-                    # Get confidence for this mode
-                    data = pytesseract.image_to_data(pil_img, config=config, output_type=pytesseract.Output.DICT)
-                    confidences = [int(data['conf'][i]) for i in range(len(data['text'])) if int(data['conf'][i]) > 0]
+                    # One Tesseract pass gives both the text and its confidence
+                    ocr = self._run_tesseract(pil_img, config)
+                    text = ocr['text']
+                    confidences = ocr['confidences']
                     avg_conf = sum(confidences) / len(confidences) if confidences else 0
                     
+                    if psm_num == 6:
+                        default_text = text
+                    
                     if avg_conf > best_confidence and len(text.strip()) > len(best_text.strip()):
                         best_text = text
                         best_confidence = avg_conf
@@ -163,8 +424,9 @@ class OCRProcessor:
             
             # If no good result, use default
             if not best_text:
-                custom_config = r'--oem 3 --psm 6'
-                best_text = pytesseract.image_to_string(pil_img, config=custom_config)
+                if default_text is None:
+                    default_text = self._run_tesseract(pil_img, r'--oem 3 --psm 6')['text']
+                best_text = default_text
             
             # Clean up extracted text
             text = self.clean_text(best_text)
@@ -173,6 +435,57 @@ class OCRProcessor:
         except Exception as e:
             raise Exception(f"OCR processing failed: {str(e)}")
     
+    def _run_tesseract(self, pil_img, config):
+        """
+        Run a single Tesseract pass and rebuild the page text from its word boxes
+        
+        Returns:
+            Dictionary with the layout text (lines and blocks preserved), the
+            confidently recognized words and their confidences
+        """
+        with span('ocr.tesseract'):
+            data = pytesseract.image_to_data(pil_img, config=config, output_type=pytesseract.Output.DICT)
+        
+        words = []
+        confidences = []
+        blocks = []
+        current_block = None
+        current_line = None
+        
+        for i in range(len(data['text'])):
+            word = data['text'][i].strip()
+            conf = int(data['conf'][i])
+            
+            if conf > 0:
+                words.append(data['text'][i])
+                confidences.append(conf)
+            
+            if not word:
+                continue
+            
+            # Group words into lines and lines into blocks, as image_to_string does
+            block = data['block_num'][i]
+            line = (block, data['par_num'][i], data['line_num'][i])
+            if block != current_block:
+                blocks.append([])
+                current_block = block
+                current_line = None
+            if line != current_line:
+                blocks[-1].append([])
+                current_line = line
+            blocks[-1][-1].append(word)
+        
+        text = '\n\n'.join(
+            '\n'.join(' '.join(line_words) for line_words in block_lines)
+            for block_lines in blocks
+        )
+        
+        return {
+            'text': text,
+            'words': words,
+            'confidences': confidences
+        }
+    
     def clean_text(self, text):
         """Clean and normalize extracted text"""
         # Remove extra whitespace
@@ -187,93 +500,152 @@ class OCRProcessor:
         
         return text.strip()
     
-    def extract_with_confidence(self, image_path, method='enhanced'):
-        """Extract text with confidence scores, trying multiple preprocessing methods"""
+    def _preprocessed_pil(self, pipeline, method):
+        """Preprocess an image for one method, or None if preprocessing fails"""
         try:
-            results = []
-            
-            # Try different preprocessing methods
-            methods = ['enhanced', 'aggressive', 'standard']
-            
-            for preprocess_method in methods:
-                try:
-                    processed_img = self.preprocess_image(image_path, method=preprocess_method)
-                    pil_img = Image.fromarray(processed_img)
-                    
-                    # Try multiple PSM modes
-                    psm_modes = [
-                        (6, r'--oem 3 --psm 6'),
-                        (11, r'--oem 3 --psm 11'),
-                        (12, r'--oem 3 --psm 12'),
-                        (3, r'--oem 3 --psm 3'),
-                    ]
-                    
-                    for psm_num, config in psm_modes:
-                        try:
-                            # Get text
-                            text = pytesseract.image_to_string(pil_img, config=config)
-                            
-                            # Get detailed data including confidence
-                            data = pytesseract.image_to_data(pil_img, config=config, output_type=pytesseract.Output.DICT)
-                            
-                            text_parts = []
-                            confidences = []
-                            
-                            for i in range(len(data['text'])):
-                                if int(data['conf'][i]) > 0:
-                                    text_parts.append(data['text'][i])
-                                    confidences.append(int(data['conf'][i]))
-                            
-                            if confidences:
-                                full_text = ' '.join(text_parts)
-                                avg_confidence = sum(confidences) / len(confidences)
-                                
-                                results.append({
-                                    'text': full_text,
-                                    'confidence': avg_confidence,
-                                    'word_count': len(text_parts),
-                                    'method': preprocess_method,
-                                    'psm': psm_num
-                                })
-                        except:
-                            continue
-                except:
-                    continue
+            return Image.fromarray(self.preprocess_image(pipeline, method=method))
+        except:
+            return None
+    
+    def _ocr_candidate(self, candidate):
+        """Run Tesseract for one (method, image, psm, config) candidate"""
+        preprocess_method, pil_img, psm_num, config = candidate
+        try:
+            # Single Tesseract pass with confidence data
+            ocr = self._run_tesseract(pil_img, config)
+            text_parts = ocr['words']
+            confidences = ocr['confidences']
             
-            # Select best result based on confidence and text length
-            if results:
-                # Sort by confidence, then by text length
-                best_result = max(results, key=lambda x: (x['confidence'], len(x['text'])))
-                return {
-                    'text': self.clean_text(best_result['text']),
-                    'confidence': best_result['confidence'],
-                    'word_count': best_result['word_count'],
-                    'method_used': best_result['method']
-                }
-            else:
-                # Fallback to standard method
-                processed_img = self.preprocess_image(image_path, method='standard')
-                pil_img = Image.fromarray(processed_img)
-                data = pytesseract.image_to_data(pil_img, output_type=pytesseract.Output.DICT)
-                
-                text_parts = []
-                confidences = []
-                
-                for i in range(len(data['text'])):
-                    if int(data['conf'][i]) > 0:
-                        text_parts.append(data['text'][i])
-                        confidences.append(int(data['conf'][i]))
-                
+            if confidences:
                 full_text = ' '.join(text_parts)
-                avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+                avg_confidence = sum(confidences) / len(confidences)
                 
                 return {
-                    'text': self.clean_text(full_text),
+                    'text': full_text,
                     'confidence': avg_confidence,
                     'word_count': len(text_parts),
-                    'method_used': 'standard'
+                    'method': preprocess_method,
+                    'psm': psm_num
                 }
+        except:
+            pass
+        return None
+    
+    def _grid_search(self, pipeline):
+        """Run every preprocessing method x PSM candidate on the worker pool"""
+        # Preprocess with every method in parallel, sharing decode and upscales
+        images = self._map(self._preprocessed_pil, [pipeline] * len(PREPROCESS_METHODS), PREPROCESS_METHODS)
+        
+        # Try multiple PSM modes per preprocessed image, all on the worker pool
+        candidates = [
+            (preprocess_method, pil_img, psm_num, config)
+            for preprocess_method, pil_img in zip(PREPROCESS_METHODS, images)
+            if pil_img is not None
+            for psm_num, config in PSM_MODES
+        ]
+        
+        # Results stay in grid order so ties resolve exactly as before
+        return [r for r in self._map(self._ocr_candidate, candidates) if r is not None]
+    
+    def _adaptive_search(self, pipeline):
+        """Try candidates in order of likelihood and stop once one is good enough"""
+        configs = dict(PSM_MODES)
+        images = {}
+        results = []
+        
+        def is_good(result):
+            return result['confidence'] >= self.min_confidence and result['word_count'] >= self.min_words
+        
+        def best_confidence():
+            return max((r['confidence'] for r in results), default=0)
+        
+        for stage in (ADAPTIVE_CANDIDATES, ADAPTIVE_FALLBACK_CANDIDATES):
+            # Only low-confidence images pay for the aggressive fallback
+            if stage is ADAPTIVE_FALLBACK_CANDIDATES and best_confidence() >= self.fallback_confidence:
+                break
+            
+            for preprocess_method, psm_num in stage:
+                # Each preprocessing method runs at most once per image
+                if preprocess_method not in images:
+                    images[preprocess_method] = self._preprocessed_pil(pipeline, preprocess_method)
+                pil_img = images[preprocess_method]
+                if pil_img is None:
+                    continue
+                
+                result = self._ocr_candidate((preprocess_method, pil_img, psm_num, configs[psm_num]))
+                if result is None:
+                    continue
+                results.append(result)
                 
+                if is_good(result):
+                    return results
+        
+        return results
+    
+    @timed('ocr.extract')
+    def extract_with_confidence(self, image_path, method='enhanced', search_mode=None):
+        """
+        Extract text with confidence scores, trying multiple preprocessing methods
+        
+        Args:
+            image_path: File path, encoded image bytes or decoded array
+            method: Unused, kept for backwards compatibility
+            search_mode: 'grid' or 'adaptive'; defaults to the processor's search_mode
+        """
+        try:
+            pipeline = self._pipeline(image_path)
+            search_mode = search_mode or self.search_mode
+            key = self._cache_key(
+                pipeline, 'extract_with_confidence',
+                search_mode=search_mode,
+                psm_modes=PSM_MODES,
+                thresholds=[self.min_confidence, self.min_words, self.fallback_confidence]
+            )
+            if key is not None:
+                cached = self.cache.get_result(key)
+                if cached is not None:
+                    return cached
+            
+            result = self._extract_with_confidence(pipeline, search_mode)
+            
+            if key is not None:
+                self.cache.put_result(key, result)
+            return result
         except Exception as e:
             raise Exception(f"OCR processing with confidence failed: {str(e)}")
+    
+    def _extract_with_confidence(self, pipeline, search_mode):
+        """Search OCR candidates and return the best result"""
+        if search_mode == 'adaptive':
+            results = self._adaptive_search(pipeline)
+        else:
+            results = self._grid_search(pipeline)
+        
+        # Select best result based on confidence and text length
+        if results:
+            # Sort by confidence, then by text length
+            best_result = max(results, key=lambda x: (x['confidence'], len(x['text'])))
+            return {
+                'text': self.clean_text(best_result['text']),
+                'confidence': best_result['confidence'],
+                'word_count': best_result['word_count'],
+                'method_used': best_result['method']
+            }
+        else:
+            # Fallback to standard method
+            processed_img = self.preprocess_image(pipeline, method='standard')
+            pil_img = Image.fromarray(processed_img)
+            ocr = self._run_tesseract(pil_img, '')
+            text_parts = ocr['words']
+            confidences = ocr['confidences']
+            
+            full_text = ' '.join(text_parts)
+            avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+            
+            return {
+                'text': self.clean_text(full_text),
+                'confidence': avg_confidence,
+                'word_count': len(text_parts),
+                'method_used': 'standard'
+            }
 
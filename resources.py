@@ -0,0 +1,91 @@
+"""
+Process-wide registry for heavy resources shared by every app session
+"""
+import os
+import threading
+import metrics
+from database import Database
+from evaluator import IntelligentEvaluator
+from jobs import JobQueue, WorkerPool
+from ocr_processor import OCRProcessor
+from ocr_cache import OCRCache
+from rubric_manager import RubricManager
+
+class ResourceRegistry:
+    """Thread-safe registry that builds each resource once, on first use"""
+    
+    def __init__(self):
+        self._resources = {}
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+    
+    def get(self, name, factory):
+        """Return the shared resource, building it with factory if needed"""
+        resource = self._resources.get(name)
+        if resource is not None:
+            return resource
+        
+        # One lock per resource so loading the model doesn't block OCR users
+        with self._registry_lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        
+        with lock:
+            resource = self._resources.get(name)
+            if resource is None:
+                resource = factory()
+                self._resources[name] = resource
+        return resource
+
+registry = ResourceRegistry()
+
+def get_database():
+    """Shared database with one engine and connection pool for all sessions"""
+    return registry.get('database', Database)
+
+def get_rubric_manager():
+    """Shared rubric manager over the shared database"""
+    return registry.get('rubric_manager', lambda: RubricManager(get_database()))
+
+def get_evaluator():
+    """Shared transformer evaluator, loaded by the first caller"""
+    def load_evaluator():
+        evaluator = IntelligentEvaluator()
+        # Embed rubric criteria and references up front so submissions only embed the answer
+        evaluator.prepare_rubrics(get_rubric_manager().get_all_rubrics())
+        return evaluator
+    return registry.get('evaluator', load_evaluator)
+
+def prepare_rubric(rubric_id):
+    """Warm the shared evaluator's embeddings for a rubric that was just created or changed"""
+    rubric = get_rubric_manager().get_rubric_by_id(rubric_id)
+    if rubric is not None:
+        get_evaluator().prepare_rubrics([rubric])
+
+def get_ocr_processor():
+    """Shared OCR processor backed by the on-disk OCR cache"""
+    return registry.get('ocr', lambda: OCRProcessor(cache=OCRCache(), scale_mode='normalized'))
+
+def get_queue():
+    """Shared evaluation job queue"""
+    return registry.get('queue', lambda: JobQueue(get_database()))
+
+def get_worker_pool():
+    """
+    Evaluation workers running inside this process, started on first use
+    
+    EVALUATOR_WORKERS sets the number of threads (default: one per CPU);
+    set it to 0 when separate `python jobs.py` processes drain the queue.
+    """
+    def start_pool():
+        num_workers = int(os.environ.get('EVALUATOR_WORKERS', os.cpu_count() or 1))
+        pool = WorkerPool(get_queue(), get_rubric_manager(), get_evaluator, get_ocr_processor,
+                          num_workers=num_workers)
+        return pool.start() if num_workers > 0 else pool
+    return registry.get('worker_pool', start_pool)
+
+def get_metrics_server():
+    """Prometheus /metrics endpoint on EVALUATOR_METRICS_PORT, or None when unset"""
+    port = os.environ.get(metrics.METRICS_PORT_ENV)
+    if not port:
+        return None
+    return registry.get('metrics_server', lambda: metrics.serve(int(port)))
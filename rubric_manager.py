@@ -1,23 +1,88 @@
 """
 Rubric management system for algorithms, flowcharts, and pseudocodes
 """
-import json
-from database import Database, Rubric
+import threading
+import time
+import numpy as np
+from types import MappingProxyType
+from database import Database, ReferenceAnswer, Rubric
 from datetime import datetime
 
+def validate_rubric(criteria, weights, keywords=None):
+    """
+    Check that a rubric can be scored
+    
+    Raises:
+        ValueError: If criteria are missing, a criterion has no weight,
+            a weight is negative, the weights don't sum to 1, or keywords
+            are declared for an unknown criterion
+    """
+    if not criteria:
+        raise ValueError("A rubric needs at least one criterion")
+    if set(weights) != set(criteria):
+        raise ValueError("Every criterion needs exactly one weight")
+    for criterion, weight in weights.items():
+        if not isinstance(weight, (int, float)) or weight < 0:
+            raise ValueError(f"Weight of {criterion} must be a non-negative number")
+    if abs(sum(weights.values()) - 1.0) > 0.01:
+        raise ValueError(f"Weights must sum to 1 (got {sum(weights.values()):.2f})")
+    for criterion, words in (keywords or {}).items():
+        if criterion not in criteria:
+            raise ValueError(f"Keywords given for unknown criterion {criterion}")
+        if isinstance(words, str) or not all(isinstance(word, str) and word.strip() for word in words):
+            raise ValueError(f"Keywords of {criterion} must be a list of non-empty strings")
+
+def _freeze_reference(reference):
+    """Read-only reference answer dictionary with its embedding as a vector"""
+    embedding = None
+    if reference.embedding is not None:
+        embedding = np.frombuffer(reference.embedding, dtype=np.float32)  # Read-only view
+    return MappingProxyType({
+        'id': reference.id,
+        'text': reference.text,
+        'embedding': embedding,
+        'embedding_model': reference.embedding_model
+    })
+
+def _freeze(rubric, references=()):
+    """Read-only rubric dictionary, safe to share between threads"""
+    return MappingProxyType({
+        'id': rubric.id,
+        'name': rubric.name,
+        'type': rubric.type,
+        'criteria': MappingProxyType(dict(rubric.criteria)),
+        'weights': MappingProxyType(dict(rubric.weights)),
+        'keywords': MappingProxyType({c: tuple(words) for c, words in (rubric.keywords or {}).items()}),
+        'references': tuple(_freeze_reference(reference) for reference in references)
+    })
+
 class RubricManager:
-    def __init__(self, db):
+    """
+    Rubrics loaded once into an in-memory cache of validated, read-only dictionaries
+    
+    Each rubric carries its reference answers. The cache is rebuilt after any
+    change made through the manager, and reloaded every refresh_interval
+    seconds to pick up edits made by other processes.
+    """
+    
+    def __init__(self, db, refresh_interval=60):
         self.db = db
-        self.session = db.get_session()
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._cache = None
+        self._loaded_at = 0
         self._initialize_default_rubrics()
     
     def _initialize_default_rubrics(self):
         """Initialize default rubrics if they don't exist"""
-        # Check if rubrics already exist
-        existing = self.session.query(Rubric).first()
-        if existing:
-            return
-        
+        # Under the write lock, so app and worker processes starting together seed them once
+        with self.db.session_scope() as session:
+            self.db.lock_for_write(session.connection())
+            if session.query(Rubric).first() is None:
+                session.add_all(self._default_rubrics())
+    
+    def _default_rubrics(self):
+        """Standard rubrics for each assignment type"""
         # Algorithm Rubric
         algorithm_criteria = {
             "correctness": "Algorithm correctly solves the problem",
@@ -37,8 +102,8 @@ class RubricManager:
         algo_rubric = Rubric(
             name="Standard Algorithm Evaluation",
             type="algorithm",
-            criteria=json.dumps(algorithm_criteria),
-            weights=json.dumps(algorithm_weights)
+            criteria=algorithm_criteria,
+            weights=algorithm_weights
         )
         
         # Flowchart Rubric
@@ -60,8 +125,8 @@ class RubricManager:
         flowchart_rubric = Rubric(
             name="Standard Flowchart Evaluation",
             type="flowchart",
-            criteria=json.dumps(flowchart_criteria),
-            weights=json.dumps(flowchart_weights)
+            criteria=flowchart_criteria,
+            weights=flowchart_weights
         )
         
         # Pseudocode Rubric
@@ -83,51 +148,141 @@ class RubricManager:
         pseudocode_rubric = Rubric(
             name="Standard Pseudocode Evaluation",
             type="pseudocode",
-            criteria=json.dumps(pseudocode_criteria),
-            weights=json.dumps(pseudocode_weights)
+            criteria=pseudocode_criteria,
+            weights=pseudocode_weights
         )
         
-        self.session.add(algo_rubric)
-        self.session.add(flowchart_rubric)
-        self.session.add(pseudocode_rubric)
-        self.session.commit()
+        return [algo_rubric, flowchart_rubric, pseudocode_rubric]
+    
+    def _rubrics(self):
+        """Cached (by_id, by_type) maps, loading them from the database when stale"""
+        cache = self._cache
+        if cache is not None and time.monotonic() - self._loaded_at < self.refresh_interval:
+            return cache
+        
+        with self._lock:
+            if self._cache is not None and self._cache is not cache:
+                return self._cache  # Another thread just reloaded; after invalidate() it is None
+            with self.db.session_scope() as session:
+                rows = session.query(Rubric).order_by(Rubric.id).all()
+                references = {}
+                for reference in session.query(ReferenceAnswer).order_by(ReferenceAnswer.id):
+                    references.setdefault(reference.rubric_id, []).append(reference)
+            
+            by_id = {}
+            by_type = {}
+            for row in rows:
+                try:
+                    validate_rubric(row.criteria, row.weights, row.keywords)
+                except ValueError as e:
+                    print(f"Warning: skipping rubric {row.id} ({row.name}): {e}")
+                    continue
+                rubric = _freeze(row, references.get(row.id, ()))
+                by_id[rubric['id']] = rubric
+                by_type.setdefault(rubric['type'], []).append(rubric)
+            
+            self._cache = (by_id, {t: tuple(r) for t, r in by_type.items()})
+            self._loaded_at = time.monotonic()
+            return self._cache
+    
+    def invalidate(self):
+        """Drop the cache so the next lookup reloads rubrics from the database"""
+        with self._lock:
+            self._cache = None
     
     def get_rubric(self, assignment_type):
-        """Get rubric for a specific assignment type"""
-        rubric = self.session.query(Rubric).filter_by(type=assignment_type).first()
-        if rubric:
-            return {
-                'id': rubric.id,
-                'name': rubric.name,
-                'type': rubric.type,
-                'criteria': json.loads(rubric.criteria),
-                'weights': json.loads(rubric.weights)
-            }
-        return None
-    
-    def create_rubric(self, name, assignment_type, criteria, weights):
-        """Create a new rubric"""
+        """Get the default (oldest) rubric for a specific assignment type"""
+        rubrics = self._rubrics()[1].get(assignment_type)
+        return rubrics[0] if rubrics else None
+    
+    def get_rubric_by_id(self, rubric_id):
+        """Get a rubric by its ID"""
+        return self._rubrics()[0].get(rubric_id)
+    
+    def get_rubrics_for_type(self, assignment_type):
+        """All rubrics for an assignment type, default first"""
+        return list(self._rubrics()[1].get(assignment_type, ()))
+    
+    def create_rubric(self, name, assignment_type, criteria, weights, keywords=None):
+        """
+        Create a new rubric
+        
+        Args:
+            keywords: Optional {criterion: [keyword, ...]} checked by the
+                evaluator's keyword heuristics instead of the defaults
+        """
+        validate_rubric(criteria, weights, keywords)
         rubric = Rubric(
             name=name,
             type=assignment_type,
-            criteria=json.dumps(criteria),
-            weights=json.dumps(weights)
+            criteria=criteria,
+            weights=weights,
+            keywords=keywords
         )
-        self.session.add(rubric)
-        self.session.commit()
+        with self.db.session_scope() as session:
+            session.add(rubric)
+        self.invalidate()
         return rubric.id
     
+    def update_rubric(self, rubric_id, name=None, criteria=None, weights=None, keywords=None):
+        """Update a rubric's name, criteria, weights or keywords"""
+        with self.db.session_scope() as session:
+            rubric = session.get(Rubric, rubric_id)
+            if rubric is None:
+                raise ValueError(f"Rubric {rubric_id} not found")
+            criteria = dict(criteria if criteria is not None else rubric.criteria)
+            weights = dict(weights if weights is not None else rubric.weights)
+            keywords = keywords if keywords is not None else rubric.keywords
+            validate_rubric(criteria, weights, keywords)
+            if name is not None:
+                rubric.name = name
+            rubric.criteria = criteria
+            rubric.weights = weights
+            rubric.keywords = keywords
+        self.invalidate()
+    
     def get_all_rubrics(self):
         """Get all rubrics"""
-        rubrics = self.session.query(Rubric).all()
-        return [
-            {
-                'id': r.id,
-                'name': r.name,
-                'type': r.type,
-                'criteria': json.loads(r.criteria),
-                'weights': json.loads(r.weights)
-            }
-            for r in rubrics
-        ]
-
+        return list(self._rubrics()[0].values())
+    
+    def add_reference_answer(self, rubric_id, text, embedding=None, embedding_model=None):
+        """
+        Store a model solution for a rubric
+        
+        Args:
+            embedding: Unit-length embedding of text, so the evaluator doesn't
+                have to encode it (see IntelligentEvaluator.embed_reference)
+            embedding_model: Model key of the evaluator that produced embedding
+        
+        Returns:
+            ID of the new reference answer
+        """
+        if not (text or '').strip():
+            raise ValueError("A reference answer needs text")
+        with self.db.session_scope() as session:
+            if session.get(Rubric, rubric_id) is None:
+                raise ValueError(f"Rubric {rubric_id} not found")
+            reference = ReferenceAnswer(
+                rubric_id=rubric_id,
+                text=text,
+                embedding=None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes(),
+                embedding_model=embedding_model if embedding is not None else None
+            )
+            session.add(reference)
+            session.flush()
+            reference_id = reference.id
+        self.invalidate()
+        return reference_id
+    
+    def delete_reference_answer(self, reference_id):
+        """Remove a reference answer"""
+        with self.db.session_scope() as session:
+            reference = session.get(ReferenceAnswer, reference_id)
+            if reference is not None:
+                session.delete(reference)
+        self.invalidate()
+    
+    def get_reference_answers(self, rubric_id):
+        """Reference answers of a rubric, oldest first"""
+        rubric = self.get_rubric_by_id(rubric_id)
+        return list(rubric['references']) if rubric else []
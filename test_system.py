@@ -1,21 +1,61 @@
 """
 Test script to verify system components are working correctly
 """
+import importlib.util
 import os
-from database import Database
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pytesseract
+from sqlalchemy import update
+from database import Base, Database, Submission, Evaluation, Job, SchemaVersion, MIGRATIONS
 from rubric_manager import RubricManager
 from evaluator import IntelligentEvaluator
-from ocr_processor import OCRProcessor
+from ocr_cache import OCRCache
+from ocr_processor import OCRProcessor, PREPROCESS_METHODS, PSM_MODES, ADAPTIVE_CANDIDATES, ADAPTIVE_FALLBACK_CANDIDATES
+from jobs import JobQueue, WorkerPool
+from grade import ResultWriter, record_saved
+from keyword_matcher import KeywordMatcher
+import metrics
 
 def test_database():
     """Test database initialization"""
     print("Testing database...")
-    db = Database('test_evaluator.db')
+    # Processes starting together on an empty database seed the default rubrics once
+    databases = [Database('test_evaluator.db') for _ in range(4)]
+    ready = threading.Barrier(len(databases))
+    def start(db):
+        ready.wait()
+        RubricManager(db)
+    starters = [threading.Thread(target=start, args=(db,)) for db in databases]
+    for starter in starters:
+        starter.start()
+    for starter in starters:
+        starter.join()
+    for db in databases[1:]:
+        db.close()
+    
+    db = databases[0]
     rubric_manager = RubricManager(db)
     rubrics = rubric_manager.get_all_rubrics()
+    assert sorted(rubric['type'] for rubric in rubrics) == ['algorithm', 'flowchart', 'pseudocode']
     print(f"✅ Database initialized. Found {len(rubrics)} rubrics.")
     db.close()
-    os.remove('test_evaluator.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('test_evaluator.db' + suffix):
+            os.remove('test_evaluator.db' + suffix)
+    
+    # An in-memory database is one database for every thread
+    db = Database(':memory:')
+    seen = []
+    reader = threading.Thread(target=lambda: seen.append(len(RubricManager(db).get_all_rubrics())))
+    reader.start()
+    reader.join()
+    assert seen == [3]
+    db.close()
     return True
 
 def test_rubric_manager():
@@ -33,11 +73,318 @@ def test_rubric_manager():
     assert flowchart_rubric is not None, "Flowchart rubric not found"
     assert pseudo_rubric is not None, "Pseudocode rubric not found"
     
+    # Cached rubrics are read-only and refreshed when rubrics change
+    try:
+        algo_rubric['weights']['correctness'] = 1.0
+        assert False, "Cached rubric should be read-only"
+    except TypeError:
+        pass
+    
+    rubric_id = rubric_manager.create_rubric(
+        'Short Algorithm Evaluation', 'algorithm',
+        {'correctness': 'Solves the problem'}, {'correctness': 1.0}
+    )
+    assert rubric_manager.get_rubric('algorithm')['id'] == algo_rubric['id']
+    assert [r['id'] for r in rubric_manager.get_rubrics_for_type('algorithm')] == [algo_rubric['id'], rubric_id]
+    
+    rubric_manager.update_rubric(rubric_id, name='Quick Algorithm Evaluation')
+    assert rubric_manager.get_rubric_by_id(rubric_id)['name'] == 'Quick Algorithm Evaluation'
+    
+    try:
+        rubric_manager.update_rubric(rubric_id, weights={'correctness': 0.5})
+        assert False, "Weights that don't sum to 1 should be rejected"
+    except ValueError:
+        pass
+    
+    reference_id = rubric_manager.add_reference_answer(rubric_id, "Return the largest item", embedding=[0.6, 0.8])
+    (reference,) = rubric_manager.get_reference_answers(rubric_id)
+    assert reference['id'] == reference_id and list(reference['embedding']) == [0.6, 0.8]
+    rubric_manager.delete_reference_answer(reference_id)
+    assert rubric_manager.get_reference_answers(rubric_id) == []
+    
+    rubric_manager.update_rubric(rubric_id, keywords={'correctness': ['return', 'base case']})
+    assert rubric_manager.get_rubric_by_id(rubric_id)['keywords']['correctness'] == ('return', 'base case')
+    try:
+        rubric_manager.update_rubric(rubric_id, keywords={'style': ['indent']})
+        assert False, "Keywords for an unknown criterion should be rejected"
+    except ValueError:
+        pass
+    
+    # A lookup that waited for the lock while the cache was invalidated reloads it
+    result = []
+    rubric_manager._loaded_at = 0
+    with rubric_manager._lock:
+        lookup = threading.Thread(target=lambda: result.append(rubric_manager.get_rubric_by_id(rubric_id)))
+        lookup.start()
+        time.sleep(0.2)
+        rubric_manager._cache = None
+    lookup.join()
+    assert result[0]['id'] == rubric_id
+    
     print("✅ Rubric manager working correctly.")
     db.close()
     os.remove('test_evaluator.db')
     return True
 
+def test_schema_upgrade():
+    """Test a database from the original release is upgraded in place, once"""
+    print("Testing schema upgrade...")
+    # Tables as created by the original release, before any migration
+    connection = sqlite3.connect('test_evaluator.db')
+    connection.executescript("""
+        CREATE TABLE rubrics (id INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, type VARCHAR(50) NOT NULL,
+            criteria TEXT NOT NULL, weights TEXT NOT NULL, created_at DATETIME);
+        CREATE TABLE submissions (id INTEGER PRIMARY KEY, student_id VARCHAR(100) NOT NULL,
+            student_name VARCHAR(200) NOT NULL, assignment_type VARCHAR(50) NOT NULL, image_path VARCHAR(500),
+            extracted_text TEXT, original_text TEXT, submitted_at DATETIME);
+        CREATE TABLE evaluations (id INTEGER PRIMARY KEY, submission_id INTEGER NOT NULL REFERENCES submissions (id),
+            rubric_id INTEGER NOT NULL REFERENCES rubrics (id), overall_score FLOAT NOT NULL,
+            detailed_scores TEXT NOT NULL, feedback TEXT NOT NULL, strengths TEXT, weaknesses TEXT,
+            suggestions TEXT, evaluated_at DATETIME);
+        INSERT INTO rubrics VALUES (1, 'Old Rubric', 'algorithm', '{"correctness": "Solves it"}',
+            '{"correctness": 1.0}', '2024-01-01 00:00:00');
+        INSERT INTO submissions VALUES (1, 'STU001', 'Test', 'algorithm', NULL, 'text', 'text', '2024-01-02 00:00:00');
+        INSERT INTO evaluations VALUES (1, 1, 1, 80.0, '{}', 'Good work!', '[]', '[]', '[]', '2024-01-02 00:00:00');
+    """)
+    connection.commit()
+    connection.close()
+    
+    # Replicas starting together: one upgrades, the others find the schema current
+    errors = []
+    def start():
+        try:
+            Database('test_evaluator.db').close()
+        except Exception as e:
+            errors.append(e)
+    starters = [threading.Thread(target=start) for _ in range(4)]
+    for starter in starters:
+        starter.start()
+    for starter in starters:
+        starter.join()
+    assert not errors, errors
+    
+    db = Database('test_evaluator.db')
+    with db.session_scope() as session:
+        versions = [row.version for row in session.query(SchemaVersion).order_by(SchemaVersion.version)]
+    assert versions == [version for version, _ in MIGRATIONS]
+    assert RubricManager(db).get_rubric('algorithm')['name'] == 'Old Rubric'
+    submission, evaluation = db.get_evaluation(1)
+    assert submission.student_id == 'STU001' and evaluation.overall_score == 80.0
+    db.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('test_evaluator.db' + suffix):
+            os.remove('test_evaluator.db' + suffix)
+    print("✅ Schema upgrade working correctly.")
+    return True
+
+def test_database_backend():
+    """Test JSON columns round-trip on the configured backend"""
+    print("Testing database backend...")
+    # Point EVALUATOR_TEST_DATABASE_URL at a scratch PostgreSQL database to
+    # run this against Postgres; it defaults to a temporary SQLite file
+    url = os.environ.get('EVALUATOR_TEST_DATABASE_URL', 'sqlite:///test_evaluator.db')
+    db = Database(url=url)
+    rubric_manager = RubricManager(db)
+    rubric = rubric_manager.get_rubric('algorithm')
+    
+    with db.session_scope() as session:
+        submission = Submission(student_id='STU001', student_name='Test', assignment_type='algorithm')
+        session.add(submission)
+        session.flush()
+        session.add(Evaluation(
+            submission_id=submission.id,
+            rubric_id=rubric['id'],
+            overall_score=72.5,
+            detailed_scores={'correctness': {'score': 80, 'max_score': 100, 'feedback': 'ok'}},
+            feedback='Good',
+            strengths=['correctness: ok'],
+            weaknesses=[],
+            suggestions=None
+        ))
+    
+    (row,), _ = db.get_results_page(student_id='STU001')
+    assert row.overall_score == 72.5
+    _, evaluation = db.get_evaluation(row.submission_id)
+    result = evaluation.to_result()
+    assert result['detailed_scores']['correctness']['score'] == 80
+    assert result['strengths'] == ['correctness: ok']
+    assert result['suggestions'] == []
+    assert db.get_score_summary()['count'] == 1
+    assert sum(count for _, count in db.get_score_histogram()) == 1
+    
+    result['overall_score'] = 90.0
+    ids = db.save_evaluations([
+        ({'student_id': f'STU00{i}', 'student_name': 'Test', 'assignment_type': 'algorithm'}, rubric['id'], result)
+        for i in (2, 3)
+    ])
+    assert len(ids) == 2
+    assert [db.get_evaluation(i)[0].student_id for i in ids] == ['STU002', 'STU003']
+    assert db.get_score_summary()['count'] == 3
+    
+    first_page, cursor = db.get_results_page(page_size=2)
+    second_page, last_cursor = db.get_results_page(page_size=2, after=cursor)
+    assert len(first_page) == 2 and len(second_page) == 1 and last_cursor is None
+    assert {row.student_id for row in first_page + second_page} == {'STU001', 'STU002', 'STU003'}
+    
+    print(f"✅ Database backend working ({db.engine.dialect.name}).")
+    Base.metadata.drop_all(db.engine)
+    db.close()
+    if os.path.exists('test_evaluator.db'):
+        os.remove('test_evaluator.db')
+    return True
+
+def test_job_queue():
+    """Test jobs are claimed once, in order, and record their outcome"""
+    print("Testing job queue...")
+    db = Database('test_jobs.db')
+    rubric = RubricManager(db).get_rubric('algorithm')
+    queue = JobQueue(db)
+    
+    first = queue.enqueue('STU001', 'Test', 'algorithm', text='READ n PRINT n')
+    second = queue.enqueue('STU002', 'Test', 'algorithm', image_path='uploads/missing.png')
+    
+    job = queue.claim('worker-1')
+    assert job.id == first and job.status == 'running' and job.attempts == 1
+    submission_id = db.save_evaluation(
+        {'student_id': job.student_id, 'student_name': job.student_name,
+         'assignment_type': job.assignment_type, 'extracted_text': job.text},
+        rubric['id'],
+        {'overall_score': 50.0, 'detailed_scores': {}, 'feedback': 'ok',
+         'strengths': [], 'weaknesses': [], 'suggestions': []}
+    )
+    queue.complete(job.id, submission_id)
+    
+    assert queue.claim('worker-2').id == second
+    assert queue.claim('worker-3') is None
+    queue.fail(second, 'No text could be extracted from the image')
+    
+    assert queue.get(first).status == 'done'
+    assert db.get_evaluation(queue.get(first).submission_id)[1].overall_score == 50.0
+    assert queue.get(second).status == 'failed'
+    
+    # A running pool requeues jobs of a worker that died after the pool started,
+    # and survives a database error while recording an outcome
+    pool = WorkerPool(queue, None, None, None, num_workers=1, poll_interval=0.05, requeue_interval=0)
+    pool.process = lambda job: submission_id
+    complete = queue.complete
+    failures = []
+    def flaky_complete(job_id, result):
+        if not failures:
+            failures.append(job_id)
+            raise RuntimeError("database is locked")
+        complete(job_id, result)
+    queue.complete = flaky_complete
+    pool.start()
+    try:
+        stuck = queue.enqueue('STU003', 'Test', 'algorithm', text='READ n PRINT n')
+        deadline = time.time() + 10
+        while queue.get(stuck).status == 'queued' and time.time() < deadline:
+            time.sleep(0.05)
+        with db.session_scope() as session:
+            session.execute(update(Job).where(Job.id == stuck).values(
+                status='running', worker='crashed', started_at=datetime.utcnow() - timedelta(hours=1)
+            ))
+        while queue.get(stuck).status != 'done' and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        pool.stop()
+        queue.complete = complete
+    assert failures == [stuck] and queue.get(stuck).status == 'done'
+    
+    print("✅ Job queue working correctly.")
+    db.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists('test_jobs.db' + suffix):
+            os.remove('test_jobs.db' + suffix)
+    return True
+
+def test_grade_resume():
+    """Test an interrupted results file resumes after its last complete record"""
+    print("Testing bulk grading resume...")
+    for path in ('test_results.jsonl', 'test_results.csv'):
+        writer = ResultWriter(path)
+        writer.write({'key': 'S1', 'student_id': 'S1', 'feedback': "Good work!\nStrengths:\n• logic"})
+        writer.write({'key': 'S2', 'student_id': 'S2', 'error': 'No text could be extracted from the image'})
+        writer.write({'key': 'S3', 'student_id': 'S3', 'feedback': "Needs work.\nAreas for Improvement:\n• syntax"})
+        writer.close()
+        
+        # Cut the last record off inside its multi-line feedback
+        with open(path, 'rb+') as f:
+            data = f.read()
+            f.truncate(data.index('Areas'.encode('utf-8')))
+        
+        writer = ResultWriter(path)
+        assert writer.done == {'S1'}, f"{path}: {writer.done}"
+        writer.write({'key': 'S3', 'student_id': 'S3', 'feedback': "Needs work.\nAreas for Improvement:\n• syntax"})
+        writer.write({'key': 'S4', 'student_id': 'S4', 'feedback': "Excellent work!"})
+        writer.close()
+        
+        writer = ResultWriter(path)
+        assert writer.done == {'S1', 'S3', 'S4'}, f"{path}: {writer.done}"
+        writer.close()
+        os.remove(path)
+    
+    # Items saved by a run that stopped before recording them are not graded again
+    db = Database('test_evaluator.db')
+    rubric = RubricManager(db).get_rubric('algorithm')
+    result = {
+        'overall_score': 75.0, 'detailed_scores': {}, 'feedback': 'Good work!',
+        'strengths': [], 'weaknesses': [], 'suggestions': []
+    }
+    submission_id = db.save_evaluation(
+        {'student_id': 'S5', 'student_name': 'S5', 'assignment_type': 'algorithm', 'grade_key': 'S5|algorithm'},
+        rubric['id'], result
+    )
+    items = [
+        {'key': f'{student_id}|algorithm', 'student_id': student_id, 'student_name': student_id,
+         'assignment_type': 'algorithm', 'image_path': None}
+        for student_id in ('S5', 'S6')
+    ]
+    writer = ResultWriter('test_results.jsonl')
+    assert [item['student_id'] for item in record_saved(db, writer, items)] == ['S6']
+    writer.close()
+    writer = ResultWriter('test_results.jsonl')
+    assert writer.done == {'S5|algorithm'}
+    writer.close()
+    assert db.get_graded_submissions(['S5|algorithm', 'S6|algorithm']) == {'S5|algorithm': submission_id}
+    db.close()
+    os.remove('test_results.jsonl')
+    os.remove('test_evaluator.db')
+    print("✅ Bulk grading resume working correctly.")
+    return True
+
+def test_metrics():
+    """Test stage timings are aggregated and exported"""
+    print("Testing metrics...")
+    registry = metrics.MetricsRegistry()
+    for seconds in (0.002, 0.02, 0.2):
+        registry.observe('test.stage', seconds)
+    
+    (stage,) = registry.summary()
+    assert stage['count'] == 3
+    assert abs(stage['total_s'] - 0.222) < 1e-9
+    assert 0.01 <= stage['p50_s'] <= 0.025
+    
+    text = registry.to_prometheus()
+    assert 'evaluator_stage_seconds_bucket{stage="test.stage",le="+Inf"} 3' in text
+    assert 'evaluator_stage_seconds_count{stage="test.stage"} 3' in text
+    
+    registry.enabled = False
+    registry.observe('test.stage', 1.0)
+    assert registry.summary()[0]['count'] == 3
+    print("✅ Metrics working correctly.")
+    return True
+
+def test_keyword_matcher():
+    """Test keywords match whole words and phrases"""
+    print("Testing keyword matcher...")
+    matcher = KeywordMatcher(['if', 'End', 'end if', 'i++'])
+    assert matcher.find("modify the list, then depend on it") == set()
+    assert matcher.find("IF x > 0 THEN ... END IF; i++") == {'if', 'end', 'end if', 'i++'}
+    assert matcher.fraction_batch(["end", "", "if it ends"]) == [0.25, 0.0, 0.25]
+    print("✅ Keyword matcher working correctly.")
+    return True
+
 def test_evaluator():
     """Test evaluation engine"""
     print("Testing evaluator...")
@@ -72,9 +419,75 @@ def test_evaluator():
     result = evaluator.evaluate(sample_answer, rubric)
     assert 'overall_score' in result
     assert 'feedback' in result
+    
+    # An answer matching a stored reference answer scores higher on content
+    reference = {
+        'id': 1,
+        'text': sample_answer,
+        'embedding': evaluator.embed_reference(sample_answer),
+        'embedding_model': evaluator.model_key
+    }
+    with_reference = evaluator.evaluate(sample_answer, dict(rubric, references=(reference,)))
+    assert with_reference['detailed_scores']['logic']['score'] >= result['detailed_scores']['logic']['score']
+    assert with_reference == evaluator.evaluate(sample_answer, rubric, reference_answer=sample_answer)
     print(f"✅ Evaluator working. Sample score: {result['overall_score']}/100")
     return True
 
+def test_evaluator_batch():
+    """Test batch evaluation matches single-answer evaluation"""
+    print("Testing batch evaluator...")
+    evaluator = IntelligentEvaluator()
+    
+    answers = [
+        "BEGIN READ number IF number > 0 THEN PRINT positive ELSE PRINT negative END IF END",
+        "too short",
+        "FUNCTION max(a, b) IF a > b THEN RETURN a ELSE RETURN b END IF END FUNCTION",
+    ]
+    rubric = {
+        'type': 'pseudocode',
+        'criteria': {
+            'syntax': 'Proper pseudocode syntax',
+            'logic': 'Correct logical flow'
+        },
+        'weights': {
+            'syntax': 0.5,
+            'logic': 0.5
+        }
+    }
+    
+    results = evaluator.evaluate_batch(answers, rubric)
+    assert len(results) == len(answers)
+    for answer, result in zip(answers, results):
+        assert result == evaluator.evaluate(answer, rubric)
+    print(f"✅ Batch evaluator working. Scores: {[r['overall_score'] for r in results]}")
+    return True
+
+def test_evaluator_backends():
+    """Test quantized and ONNX backends score within tolerance of fp32 torch"""
+    print("Testing evaluator backends...")
+    answers = [
+        "BEGIN READ number IF number > 0 THEN PRINT positive ELSE PRINT negative END IF END",
+        "FUNCTION max(a, b) IF a > b THEN RETURN a ELSE RETURN b END IF END FUNCTION",
+        "Step 1: Read the array. Step 2: For each element compare with the current maximum. Step 3: Print the maximum.",
+    ]
+    db = Database('test_evaluator.db')
+    rubric = RubricManager(db).get_rubric('pseudocode')
+    reference = IntelligentEvaluator(backend='torch').evaluate_batch(answers, rubric)
+    
+    backends = ['int8']
+    if importlib.util.find_spec('optimum') is not None:
+        backends.append('onnx')
+    for backend in backends:
+        results = IntelligentEvaluator(backend=backend).evaluate_batch(answers, rubric)
+        for expected, result in zip(reference, results):
+            assert abs(result['overall_score'] - expected['overall_score']) <= 3.0, \
+                f"{backend} score {result['overall_score']} differs from {expected['overall_score']}"
+    
+    print(f"✅ Evaluator backends within tolerance: {', '.join(backends)}")
+    db.close()
+    os.remove('test_evaluator.db')
+    return True
+
 def test_ocr_processor():
     """Test OCR processor (without actual image)"""
     print("Testing OCR processor...")
@@ -83,6 +496,173 @@ def test_ocr_processor():
     print("   Note: Full OCR test requires an actual image file.")
     return True
 
+# With scale_mode='fixed' each method resizes this 60px wide image by a different factor
+OCR_TEST_IMAGE = np.full((40, 60), 255, np.uint8)
+OCR_TEST_IMAGE[15:25, 10:50] = 0
+OCR_TEST_WIDTHS = {120: 'enhanced', 180: 'aggressive', 60: 'standard'}
+
+def stub_tesseract(outputs, calls, delays=None):
+    """
+    Replace pytesseract.image_to_data with a stub returning one line of words
+    
+    Args:
+        outputs: Dictionary of (method, psm) to a list of (word, conf) pairs
+        calls: List the stub appends each (method, psm) it is called with to
+        delays: Optional dictionary of method to seconds to sleep per call
+    
+    Returns:
+        The original image_to_data, to restore afterwards
+    """
+    original = pytesseract.image_to_data
+    def image_to_data(pil_img, config='', output_type=None):
+        method = OCR_TEST_WIDTHS[pil_img.size[0]]
+        psm = int(config.split('--psm ')[1]) if '--psm' in config else None
+        calls.append((method, psm))
+        time.sleep((delays or {}).get(method, 0))
+        words = outputs.get((method, psm), [])
+        return {
+            'text': [word for word, _ in words],
+            'conf': [conf for _, conf in words],
+            'block_num': [1] * len(words),
+            'par_num': [1] * len(words),
+            'line_num': [1] * len(words)
+        }
+    pytesseract.image_to_data = image_to_data
+    return original
+
+def test_ocr_grid_search():
+    """Test the parallel grid picks the same candidate as the sequential search"""
+    print("Testing OCR grid search...")
+    # 'aggressive' psm 11 and 'standard' psm 3 tie on confidence and text length
+    outputs = {
+        ('enhanced', 6): [('enhanced', 70), ('six', 80)],
+        ('aggressive', 11): [('alpha', 90), ('beta', 90)],
+        ('aggressive', 12): [('low', 40)],
+        ('standard', 3): [('gamma', 90), ('delt', 90)],
+        ('standard', 6): [('', -1), ('skipped', 0)],
+    }
+    
+    # The original search ran every method x PSM in order and kept the first maximum
+    expected = None
+    for method in PREPROCESS_METHODS:
+        for psm, _ in PSM_MODES:
+            words = [(word, conf) for word, conf in outputs.get((method, psm), []) if conf > 0]
+            if not words:
+                continue
+            key = (sum(conf for _, conf in words) / len(words), len(' '.join(word for word, _ in words)))
+            if expected is None or key > expected[0]:
+                expected = (key, method, ' '.join(word for word, _ in words))
+    assert expected[1:] == ('aggressive', 'alpha beta'), expected
+    
+    calls = []
+    # Earlier candidates finish last, so completion order differs from grid order
+    original = stub_tesseract(outputs, calls, delays={'enhanced': 0.02, 'aggressive': 0.01})
+    try:
+        result = OCRProcessor(max_workers=4).extract_with_confidence(OCR_TEST_IMAGE)
+    finally:
+        pytesseract.image_to_data = original
+    
+    assert (result['method_used'], result['text']) == expected[1:], result
+    assert result['confidence'] == 90 and result['word_count'] == 2, result
+    assert sorted(calls) == sorted((method, psm) for method in PREPROCESS_METHODS for psm, _ in PSM_MODES), calls
+    print(f"✅ Grid search picked {result['method_used']} on a tie, as the sequential search did.")
+    return True
+
+def test_ocr_tesseract_pass():
+    """Test one image_to_data pass gives the layout text and the confident words"""
+    print("Testing single Tesseract pass...")
+    data = {
+        'text': ['', 'if', 'x', '', 'then', '?', '', 'print', 'x'],
+        'conf': ['-1', '91', '88', '-1', '75', '0', '-1', '95', '-1'],
+        'block_num': [1, 1, 1, 1, 1, 1, 2, 2, 2],
+        'par_num': [1, 1, 1, 1, 1, 1, 1, 1, 1],
+        'line_num': [1, 1, 1, 2, 2, 2, 1, 1, 1],
+    }
+    original = pytesseract.image_to_data
+    pytesseract.image_to_data = lambda pil_img, config='', output_type=None: data
+    try:
+        ocr = OCRProcessor()._run_tesseract(None, r'--oem 3 --psm 6')
+    finally:
+        pytesseract.image_to_data = original
+    
+    # Lines and blocks are rebuilt as image_to_string lays them out
+    assert ocr['text'] == "if x\nthen ?\n\nprint x", repr(ocr['text'])
+    # Entries with conf <= 0 are left out of the words and confidences
+    assert ocr['words'] == ['if', 'x', 'then', 'print'], ocr['words']
+    assert ocr['confidences'] == [91, 88, 75, 95], ocr['confidences']
+    print("✅ Tesseract pass rebuilt the layout and dropped unconfident words.")
+    return True
+
+def test_ocr_adaptive_search():
+    """Test adaptive search stops early and only falls back for low confidence"""
+    print("Testing adaptive OCR search...")
+    words = ['for', 'each', 'item', 'in', 'list']
+    ocr = OCRProcessor(max_workers=1, search_mode='adaptive', min_confidence=85, min_words=5, fallback_confidence=60)
+    
+    def run(outputs):
+        calls = []
+        original = stub_tesseract(outputs, calls)
+        try:
+            return ocr.extract_with_confidence(OCR_TEST_IMAGE), calls
+        finally:
+            pytesseract.image_to_data = original
+    
+    # Stops at the first candidate meeting min_confidence and min_words
+    result, calls = run({
+        ('enhanced', 6): [(word, 90) for word in words[:3]],
+        ('enhanced', 3): [(word, 90) for word in words],
+        ('standard', 6): [(word, 99) for word in words],
+    })
+    assert calls == ADAPTIVE_CANDIDATES[:2], calls
+    assert result['method_used'] == 'enhanced' and result['word_count'] == 5, result
+    
+    # A first tier that misses the thresholds but reaches fallback_confidence skips the fallback
+    result, calls = run({('standard', 11): [(word, 70) for word in words]})
+    assert calls == ADAPTIVE_CANDIDATES, calls
+    assert result['method_used'] == 'standard' and result['confidence'] == 70, result
+    
+    # A low-confidence first tier runs the aggressive fallback, which also stops early
+    result, calls = run({
+        ('enhanced', 6): [(word, 40) for word in words],
+        ('aggressive', 3): [(word, 88) for word in words],
+    })
+    assert calls == ADAPTIVE_CANDIDATES + ADAPTIVE_FALLBACK_CANDIDATES[:2], calls
+    assert result['method_used'] == 'aggressive' and result['confidence'] == 88, result
+    print("✅ Adaptive search stopped early and fell back only for low confidence.")
+    return True
+
+def test_ocr_cache():
+    """Test repeated images are served from the OCR cache and the cache stays bounded"""
+    print("Testing OCR cache...")
+    shutil.rmtree('test_ocr_cache', ignore_errors=True)
+    try:
+        calls = []
+        original = stub_tesseract({('enhanced', 6): [('cached', 90)]}, calls)
+        try:
+            ocr = OCRProcessor(max_workers=2, cache=OCRCache('test_ocr_cache'))
+            first = ocr.extract_with_confidence(OCR_TEST_IMAGE)
+            runs = len(calls)
+            second = ocr.extract_with_confidence(OCR_TEST_IMAGE.copy())
+        finally:
+            pytesseract.image_to_data = original
+        assert runs > 0 and len(calls) == runs, f"{runs} Tesseract runs, then {len(calls)}"
+        assert second == first, second
+        
+        # Least recently used entries are evicted so the folder stays under max_bytes
+        cache = OCRCache('test_ocr_cache', max_bytes=2000)
+        for i in range(20):
+            cache.put_result(f'key{i}', {'text': 'x' * 150})
+            if i >= 5:
+                assert cache.get_result('key0') is not None, f"key0 evicted after key{i}"
+            size = sum(entry.stat().st_size for entry in os.scandir('test_ocr_cache'))
+            assert size <= cache.max_bytes, f"{size} bytes after key{i}"
+            time.sleep(0.01)
+        assert cache.get_result('key1') is None and cache.get_result('key19') is not None
+    finally:
+        shutil.rmtree('test_ocr_cache', ignore_errors=True)
+    print("✅ OCR cache served a repeated image and stayed under max_bytes.")
+    return True
+
 def main():
     """Run all tests"""
     print("=" * 50)
@@ -93,8 +673,20 @@ def main():
     try:
         test_database()
         test_rubric_manager()
+        test_schema_upgrade()
+        test_database_backend()
+        test_job_queue()
+        test_grade_resume()
+        test_metrics()
+        test_keyword_matcher()
         test_evaluator()
+        test_evaluator_batch()
+        test_evaluator_backends()
         test_ocr_processor()
+        test_ocr_grid_search()
+        test_ocr_tesseract_pass()
+        test_ocr_adaptive_search()
+        test_ocr_cache()
         
         print()
         print("=" * 50)
@@ -102,7 +694,7 @@ def main():
         print("=" * 50)
         print()
         print("Next step: Run 'streamlit run app.py' to start the application.")
-        
+    
     except Exception as e:
         print(f"❌ Test failed: {str(e)}")
         import traceback